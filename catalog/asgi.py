@@ -0,0 +1,7 @@
+import sys
+
+sys.path.append('/var/www/catalog/')
+
+from asyncApi import createAsyncApp
+
+application = createAsyncApp()
@@ -0,0 +1,393 @@
+#!/usr/local/bin/python3
+"""
+The assets.py module is a module intended to build and serve the stylesheets
+of the Catalog Application.
+
+The third-party stylesheets (w3.css, font-awesome and the Comfortaa font) are
+vendored into static/vendor along with the fonts they use, so that pages
+don't depend on round trips to other sites. A build then bundles them with
+css/main.css into a single stylesheet. It fingerprints the bundle and every
+file the bundle refers to with a hash of its content, and writes gzip (and,
+when the brotli package is installed, brotli) copies next to them in
+static/build.
+
+Built files never change under the same name, so they are served from
+/assets/ as immutable for a year and browsers don't ask for them again. The
+pre-compressed copies are sent as they are, through send_file, which hands
+the file to the server (wsgi.file_wrapper, or X-Sendfile when
+CATALOG_ASSET_X_SENDFILE is set to 1) rather than reading it into Python.
+
+Until the assets have been vendored and built, pages link the original
+files, from static/ when they exist and from their CDN otherwise.
+
+Usage
+=======================================================
+python3 assets.py vendor   download the third-party stylesheets and fonts
+python3 assets.py build    bundle, fingerprint and compress them
+"""
+from flask import abort, request, send_file, url_for
+from markupsafe import Markup, escape
+from werkzeug.utils import safe_join
+
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import sys
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "static")
+BUILD_DIR = os.path.join(STATIC_DIR, "build")
+MANIFEST = os.path.join(BUILD_DIR, "manifest.json")
+
+# The third-party stylesheets, by where they are vendored under static/ and
+# where they come from
+VENDORED = (
+    ("vendor/comfortaa/comfortaa.css",
+     "https://fonts.googleapis.com/css?family=Comfortaa"),
+    ("vendor/w3css/w3.css", "https://www.w3schools.com/w3css/4/w3.css"),
+    ("vendor/font-awesome/css/font-awesome.min.css",
+     "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/"
+     "font-awesome.min.css"),
+)
+
+# The bundles to build, each one the files under static/ joined in order
+BUNDLES = {
+    "site.css": [path for path, url in VENDORED] + ["css/main.css"],
+}
+
+# Built assets never change, so they can be kept for as long as browsers will
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Fonts like woff and woff2 are compressed already
+COMPRESSIBLE = (".css", ".js", ".svg", ".ttf", ".eot", ".otf")
+
+# The encodings of the pre-compressed copies, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+URL_REFERENCE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+# Google Fonts picks the font format from the User-Agent, this gets woff2
+VENDOR_USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                     "AppleWebKit/537.36 (KHTML, like Gecko) "
+                     "Chrome/120.0 Safari/537.36")
+VENDOR_TIMEOUT = (5, 30)
+
+_manifest = None
+
+
+def _writeFile(path, content):
+    # written to a temporary file first so that a request never sees half
+    # a file
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory)
+    with os.fdopen(descriptor, "wb") as output:
+        output.write(content)
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, path)
+
+
+def _splitReference(reference):
+    # "../fonts/x.eot?#iefix" -> ("../fonts/x.eot", "?#iefix")
+    match = re.search(r"[?#]", reference)
+    if match is None:
+        return reference, ""
+    return reference[:match.start()], reference[match.start():]
+
+
+def _isLocal(reference):
+    return not (reference.startswith(("data:", "#", "/")) or
+                re.match(r"^[a-z][a-z0-9+.-]*:", reference, re.I))
+
+
+def vendor(report=print):
+    """
+    Function to download the third-party stylesheets into static/vendor,
+    along with the fonts they refer to. The stylesheets are rewritten to
+    refer to the downloaded fonts.
+
+    Parameters
+    =======================================================
+    report - function
+        Called with the path of each file written.
+
+    Returns
+    =======================================================
+    None
+    """
+    from urllib.parse import urljoin, urlsplit
+    import requests
+
+    http = requests.Session()
+    http.headers["User-Agent"] = VENDOR_USER_AGENT
+    fetched = set()
+    for path, url in VENDORED:
+        response = http.get(url, timeout=VENDOR_TIMEOUT)
+        response.raise_for_status()
+        directory = posixpath.dirname(path)
+
+        def localise(match):
+            reference, suffix = _splitReference(match.group(2))
+            if reference.startswith("data:"):
+                return match.group(0)
+            source = urljoin(url, reference)
+            name = posixpath.basename(urlsplit(source).path)
+            # fonts land next to the stylesheet's own fonts directory
+            target = posixpath.normpath(posixpath.join(
+                directory, reference if _isLocal(reference) else
+                posixpath.join("fonts", name)))
+            if target not in fetched:
+                font = http.get(source, timeout=VENDOR_TIMEOUT)
+                font.raise_for_status()
+                _writeFile(os.path.join(STATIC_DIR, target), font.content)
+                fetched.add(target)
+                report(target)
+            return 'url("{0}{1}")'.format(
+                posixpath.relpath(target, directory), suffix)
+
+        css = URL_REFERENCE.sub(localise, response.text)
+        _writeFile(os.path.join(STATIC_DIR, path), css.encode("utf-8"))
+        report(path)
+
+
+def compress(path, content):
+    """
+    Function to write the pre-compressed copies of a built file, keeping
+    only those that come out smaller.
+
+    Parameters
+    =======================================================
+    path - string
+        The path of the built file.
+    content - bytes
+        The content of the built file.
+
+    Returns
+    =======================================================
+    None
+    """
+    compressed = {".gz": gzip.compress(content, 9, mtime=0)}
+    if brotli is not None:
+        compressed[".br"] = brotli.compress(content, quality=11)
+    for suffix, data in compressed.items():
+        if len(data) < len(content):
+            _writeFile(path + suffix, data)
+
+
+def writeFingerprinted(name, content):
+    """
+    Function to write a built file under a name that carries a hash of its
+    content, with its pre-compressed copies.
+
+    Parameters
+    =======================================================
+    name - string
+        The name of the file, relative to static/build.
+    content - bytes
+        The content of the file.
+
+    Returns
+    =======================================================
+    string -
+        The fingerprinted name, relative to static/build.
+    """
+    stem, extension = posixpath.splitext(name)
+    built = "{0}.{1}{2}".format(stem, hashlib.sha256(content).hexdigest()[:12],
+                                extension)
+    path = os.path.join(BUILD_DIR, built)
+    if not os.path.exists(path):
+        _writeFile(path, content)
+        if extension in COMPRESSIBLE:
+            compress(path, content)
+    return built
+
+
+def build(report=print):
+    """
+    Function to build every bundle into static/build and record the
+    fingerprinted names in the manifest. The files a bundle refers to (ie
+    fonts) are fingerprinted as well and the bundle rewritten to use them.
+    Older builds are left in place for pages still referring to them.
+
+    Parameters
+    =======================================================
+    report - function
+        Called with the name of each bundle and its fingerprinted name.
+
+    Returns
+    =======================================================
+    dictionary -
+        The manifest, bundle name to fingerprinted name.
+
+    Raises
+    =======================================================
+    IOError -
+        If a file of a bundle is missing, ie it has not been vendored yet.
+    """
+    manifest = {}
+    for bundle, sources in sorted(BUNDLES.items()):
+        bundleDirectory = posixpath.dirname(bundle)
+        parts = []
+        for source in sources:
+            directory = posixpath.dirname(source)
+
+            def fingerprint(match):
+                reference, suffix = _splitReference(match.group(2))
+                if not _isLocal(reference):
+                    return match.group(0)
+                target = posixpath.normpath(posixpath.join(directory,
+                                                           reference))
+                with open(os.path.join(STATIC_DIR, target), "rb") as asset:
+                    built = writeFingerprinted(target, asset.read())
+                return 'url("{0}{1}")'.format(
+                    posixpath.relpath(built, bundleDirectory or "."), suffix)
+
+            with open(os.path.join(STATIC_DIR, source), "r",
+                      encoding="utf-8") as stylesheet:
+                css = URL_REFERENCE.sub(fingerprint, stylesheet.read())
+            parts.append("/* {0} */\n{1}".format(source, css))
+        manifest[bundle] = writeFingerprinted(
+            bundle, "\n".join(parts).encode("utf-8"))
+        report("{0} -> {1}".format(bundle, manifest[bundle]))
+    _writeFile(MANIFEST, json.dumps(manifest, indent=2,
+                                    sort_keys=True).encode("utf-8"))
+    return manifest
+
+
+def loadManifest():
+    """
+    Function to read the manifest of the last build, once per process.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    dictionary -
+        Bundle name to fingerprinted name, empty if nothing has been built.
+    """
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST, "r") as manifestFile:
+                _manifest = json.load(manifestFile)
+        except (IOError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+def stylesheets(bundle):
+    """
+    Function for the templates to link a bundle of stylesheets - the built
+    bundle if there is one, otherwise each of its files.
+
+    Parameters
+    =======================================================
+    bundle - string
+        The name of the bundle, one of BUNDLES.
+
+    Returns
+    =======================================================
+    Markup -
+        The link tags.
+    """
+    built = loadManifest().get(bundle)
+    if built is not None:
+        urls = [url_for("serveAsset", filename=built)]
+    else:
+        remote = dict(VENDORED)
+        urls = [url_for("static", filename=source)
+                if source not in remote or
+                os.path.exists(os.path.join(STATIC_DIR, source))
+                else remote[source] for source in BUNDLES[bundle]]
+    return Markup("\n    ".join('<link rel="stylesheet" href="{0}">'.format(
+        escape(url)) for url in urls))
+
+
+def serveAsset(filename):
+    """
+    Function that handles the routes to '/assets/<filename>' and sends a
+    built asset, pre-compressed if the client accepts it, to be cached for
+    good.
+
+    Parameters
+    =======================================================
+    filename - string
+        The fingerprinted name of the asset.
+
+    Returns
+    =======================================================
+    Response -
+        The asset, or a 404 if there is no such built file.
+    """
+    path = safe_join(BUILD_DIR, filename)
+    if path is None or filename.endswith(tuple(
+            suffix for encoding, suffix in ENCODINGS)) or \
+            not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or \
+        "application/octet-stream"
+    encoding = None
+    for candidate, suffix in ENCODINGS:
+        if request.accept_encodings[candidate] and \
+                os.path.isfile(path + suffix):
+            encoding = candidate
+            path += suffix
+            break
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Cache-Control"] = ASSET_CACHE_CONTROL
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def installAssets(app):
+    """
+    Function to add the asset route and the stylesheets template function
+    to an app.
+
+    Parameters
+    =======================================================
+    app - Flask
+        The flask app to serve the assets from.
+
+    Returns
+    =======================================================
+    None
+    """
+    app.config.setdefault("USE_X_SENDFILE", os.environ.get(
+        "CATALOG_ASSET_X_SENDFILE", "0") == "1")
+    app.add_url_rule("/assets/<path:filename>", "serveAsset", serveAsset)
+    app.add_template_global(stylesheets)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=("vendor", "build"))
+    args = parser.parse_args(argv)
+    if args.command == "vendor":
+        vendor()
+    else:
+        try:
+            build()
+        except IOError as error:
+            print("{0} - run 'python3 assets.py vendor' first".format(error))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
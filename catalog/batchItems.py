@@ -0,0 +1,229 @@
+#!/usr/local/bin/python3
+"""
+The batchItems.py module is a module intended to apply a batch of item
+create, update and delete operations for the Catalog Application in a single
+transaction.
+
+Everything the batch needs from the DB (the items it touches, the categories
+it names and the names it wants to create) is loaded up front in a handful
+of queries, each operation is then checked and applied in memory, and the
+whole batch is written with a single flush. An operation that fails its
+checks is reported and skipped, the rest of the batch still goes through.
+
+The rules are those of the form routes - only the creator of an item may
+change or delete it, item names are unique, an edit only changes the
+description and category, and a category left without items is removed.
+
+Operations
+=======================================================
+{"op": "create", "name": ..., "description": ..., "category": ...}
+{"op": "update", "id": ..., "description": ..., "category": ...}
+{"op": "delete", "id": ...}
+"""
+from models import Item, Category
+
+# The most values put in a single IN (...) clause
+CHUNK = 500
+
+
+def chunked(values, size=CHUNK):
+    """
+    Function to split a list of values into lists of at most size values.
+    """
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def result(status, op, itemId=None, error=None):
+    """
+    Function to build the result reported for one operation.
+
+    Parameters
+    =======================================================
+    status - int
+        The HTTP status the operation would have got on its own.
+    op - string
+        The operation asked for.
+    itemId - int
+        The id of the item operated on, if known.
+    error - string
+        Why the operation failed, if it did.
+
+    Returns
+    =======================================================
+    dictionary of the result.
+    """
+    outcome = {"op": op, "status": status, "id": itemId}
+    if error is not None:
+        outcome["error"] = error
+    return outcome
+
+
+def isDescription(value):
+    """
+    Function to check that an operation's description, if it gave one, is
+    something that can be stored.
+    """
+    return value is None or isinstance(value, str)
+
+
+class ItemBatch(object):
+    """
+    ItemBatch class to check and apply a list of item operations on behalf of
+    a user. Nothing is committed, that is left to the caller.
+
+    Attributes
+    =======================================================
+    session - sqlalchemy session
+        The session to apply the operations in.
+    userId - int
+        The id of the user making the changes.
+    results - list of dictionaries
+        The result of each operation, in order.
+    """
+
+    def __init__(self, session, userId):
+        self.session = session
+        self.userId = userId
+        self.results = []
+        self._items = {}
+        self._categories = {}
+        self._names = set()
+        self._touched = set()
+        self._created = []
+
+    def _load(self, operations):
+        itemIds = set()
+        categoryNames = set()
+        names = set()
+        for operation in operations:
+            if not isinstance(operation, dict):
+                continue
+            if isinstance(operation.get("id"), int):
+                itemIds.add(operation["id"])
+            if isinstance(operation.get("category"), str):
+                categoryNames.add(operation["category"])
+            if operation.get("op") == "create" and \
+                    isinstance(operation.get("name"), str):
+                names.add(operation["name"])
+
+        for ids in chunked(itemIds):
+            for item in self.session.query(Item).filter(Item.id.in_(ids)):
+                self._items[item.id] = item
+        for chunk in chunked(categoryNames):
+            for category in self.session.query(Category).filter(
+                    Category.name.in_(chunk)):
+                self._categories[category.name] = category
+        for chunk in chunked(names):
+            self._names.update(name for name, in self.session.query(
+                Item.name).filter(Item.name.in_(chunk)))
+
+    def _category(self, name):
+        category = self._categories.get(name)
+        if category is None:
+            category = Category(name=name)
+            self.session.add(category)
+            self._categories[name] = category
+        return category
+
+    def _owned(self, operation):
+        # returns the item the user may change, or the failed result
+        itemId = operation.get("id")
+        if not isinstance(itemId, int) or isinstance(itemId, bool):
+            return None, result(400, operation["op"], error="id required")
+        item = self._items.get(itemId)
+        if item is None:
+            return None, result(404, operation["op"], operation.get("id"),
+                                "no such item")
+        if item.user_id != self.userId:
+            return None, result(403, operation["op"], item.id,
+                                "not the creator of the item")
+        return item, None
+
+    def _create(self, operation):
+        name = operation.get("name")
+        categoryName = operation.get("category")
+        if not isinstance(name, str) or not name or \
+                not isinstance(categoryName, str) or not categoryName:
+            return result(400, "create", error="name and category required")
+        if not isDescription(operation.get("description")):
+            return result(400, "create", error="bad description")
+        if name in self._names:
+            return result(409, "create", error="item already exists")
+        self._names.add(name)
+        category = self._category(categoryName)
+        self._touched.add(category)
+        item = Item(user_id=self.userId, name=name,
+                    description=operation.get("description"),
+                    category=category)
+        self.session.add(item)
+        self._created.append((len(self.results), item))
+        return result(201, "create")
+
+    def _update(self, operation):
+        item, failed = self._owned(operation)
+        if failed is not None:
+            return failed
+        if not isDescription(operation.get("description")):
+            return result(400, "update", item.id, "bad description")
+        categoryName = operation.get("category")
+        if categoryName is not None:
+            if not isinstance(categoryName, str) or not categoryName:
+                return result(400, "update", item.id, "bad category")
+            self._touched.add(item.category_id)
+            item.category = self._category(categoryName)
+        if "description" in operation:
+            item.description = operation["description"]
+        return result(200, "update", item.id)
+
+    def _delete(self, operation):
+        item, failed = self._owned(operation)
+        if failed is not None:
+            return failed
+        self._touched.add(item.category_id)
+        self.session.delete(item)
+        del self._items[item.id]
+        return result(200, "delete", item.id)
+
+    def apply(self, operations):
+        """
+        Function to check and apply every operation, then flush the changes
+        and remove the categories the batch left empty.
+
+        Parameters
+        =======================================================
+        operations - list of dictionaries
+            The operations, see the module documentation.
+
+        Returns
+        =======================================================
+        list of dictionaries -
+            The result of each operation, in order. Each holds the op, an
+            HTTP style status, the item id and, on failure, an error.
+        """
+        self._load(operations)
+        handlers = {"create": self._create, "update": self._update,
+                    "delete": self._delete}
+        for operation in operations:
+            op = operation.get("op") if isinstance(operation, dict) else None
+            handler = handlers.get(op) if isinstance(op, str) else None
+            if handler is None:
+                self.results.append(result(400, None, error="unknown op"))
+            else:
+                self.results.append(handler(operation))
+        self.session.flush()
+
+        for index, item in self._created:
+            self.results[index]["id"] = item.id
+        # the categories are either ids or, when created by this batch,
+        # Category objects that only got their id from the flush
+        touched = set(category.id if isinstance(category, Category)
+                      else category for category in self._touched)
+        touched.discard(None)
+        for ids in chunked(touched):
+            for category in self.session.query(Category).filter(
+                    Category.id.in_(ids), Category.item_count == 0):
+                self.session.delete(category)
+        self.session.flush()
+        return self.results
@@ -0,0 +1,1428 @@
+#!/usr/local/bin/python3
+"""
+The benchmark.py module is a standalone module intended to measure the
+performance of the Catalog Application against a synthetic catalog.
+
+By default the benchmarks run against a throwaway sqlite file so they can be
+run anywhere, set CATALOG_BENCH_DATABASE_URL to point them at a local
+postgres instance instead. They never use CATALOG_DATABASE_URL, which may
+point at the real catalog, and seeding wipes the DB - anything but sqlite is
+refused unless --force is given.
+
+Usage
+=======================================================
+python3 benchmark.py export --categories 5000 --items 5
+python3 benchmark.py pages --categories 50 --items 20
+python3 benchmark.py lookups --categories 10000 --items 100
+python3 benchmark.py concurrency --threads 1 2 4 8 --requests 200
+python3 benchmark.py edit
+python3 benchmark.py routes --size 100k --output before.json
+python3 benchmark.py compare before.json after.json
+python3 benchmark.py logging --requests 20000
+python3 benchmark.py search --categories 10000 --items 100
+python3 benchmark.py serializers --categories 5000 --items 20
+python3 benchmark.py batch --operations 3000 --batch-size 500
+python3 benchmark.py replicas --replicas 2 --requests 1000
+python3 benchmark.py compression --sizes 1k 100k
+python3 benchmark.py startup --runs 10
+python3 benchmark.py asgi --concurrency 1 10 100 1000 --requests 5000
+python3 benchmark.py changes --categories 1000 --changes 0 10 100 1000
+python3 benchmark.py --force pages    against CATALOG_BENCH_DATABASE_URL
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# the app modules read CATALOG_DATABASE_URL when imported, so it is pointed
+# at the benchmark DB first
+os.environ["CATALOG_DATABASE_URL"] = os.environ.get(
+    "CATALOG_BENCH_DATABASE_URL", "sqlite:///benchmark.db")
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from models import Base, Item, Category, User, DATABASE_URL, REPLICA_URLS
+from catalogExport import exportCatalog
+from changeFeed import seedChanges
+from search import MemorySearch, createSearchIndex
+
+
+class QueryCounter(object):
+    """
+    Context manager that counts the SQL statements issued against an engine
+    while it is active.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _onExecute(self, conn, cursor, statement, parameters, context,
+                   executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._onExecute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._onExecute)
+
+
+class WipeRefused(Exception):
+    """
+    WipeRefused exception raised when seeding would wipe a DB that is not a
+    scratch sqlite one and --force was not given.
+    """
+
+
+def isScratchDatabase(url):
+    """
+    Whether a DB url is a sqlite one, which the benchmarks may wipe without
+    --force.
+    """
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+# Items are inserted this many at a time when seeding
+SEED_BATCH = 50000
+
+
+def seedCatalog(engine, categories, itemsPerCategory, users=1,
+                describe=None, force=False):
+    """
+    Function to wipe the DB and fill it with a synthetic catalog, recording
+    it in the change log as migrate.py would.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy engine
+        The engine for the DB to seed.
+    categories - int
+        The number of categories to create.
+    itemsPerCategory - int
+        The number of items to create under each category.
+    users - int
+        The number of users to create, items are shared out between them.
+    describe - function
+        Called with the item number to make up its description, by default
+        every item is described as "benchmark item".
+    force - bool
+        Wipe the DB even if it is not a sqlite one.
+
+    Raises
+    =======================================================
+    WipeRefused -
+        If the DB is not a sqlite one and force is not set.
+    """
+    if not force and not isScratchDatabase(engine.url):
+        raise WipeRefused("refusing to wipe {0}, pass --force to seed "
+                          "it".format(engine.url.render_as_string(
+                              hide_password=True)))
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(),
+                     [{"id": u + 1, "name": "Bench{0}".format(u),
+                       "email": userEmail(u), "picture": ""}
+                      for u in range(users)])
+        conn.execute(Category.__table__.insert(),
+                     [{"id": c + 1, "name": "category{0:06d}".format(c),
+                       "item_count": itemsPerCategory}
+                      for c in range(categories)])
+        rows = []
+        count = 0
+        for c in range(categories):
+            for i in range(itemsPerCategory):
+                rows.append({"name": "item{0:06d}-{1:03d}".format(c, i),
+                             "description": describe(count)
+                             if describe else "benchmark item",
+                             "category_id": c + 1,
+                             "user_id": (count % users) + 1})
+                count += 1
+                if len(rows) == SEED_BATCH:
+                    conn.execute(Item.__table__.insert(), rows)
+                    rows = []
+        if rows:
+            conn.execute(Item.__table__.insert(), rows)
+        seedChanges(conn)
+
+
+def userEmail(index):
+    """
+    The email address seedCatalog gives the user at index, the first user
+    being bench@example.com.
+    """
+    if index == 0:
+        return "bench@example.com"
+    return "bench{0}@example.com".format(index)
+
+
+def loginClient(client, userId=1):
+    """
+    Mark a test client's session as logged in as one of the seeded users,
+    standing in for the Google/Facebook OAuth flow.
+    """
+    with client.session_transaction() as login_session:
+        login_session["provider"] = "google"
+        login_session["username"] = "Bench{0}".format(userId - 1)
+        login_session["email"] = userEmail(userId - 1)
+        login_session["picture"] = ""
+        login_session["user_id"] = userId
+
+
+def benchApp(config=None):
+    """
+    Create the app under test, once the catalog has been seeded, with the
+    search index installed as migrate.py would.
+    """
+    import catalogApp
+    app = catalogApp.createApp(config)
+    catalogApp.searchIndex.install(catalogApp.engine)
+    return app
+
+
+def legacyExport(session):
+    """
+    The original per-category export, kept only as a benchmark baseline.
+    """
+    categories = session.query(Category).order_by(Category.name).all()
+    cate_dict = [entry.serialize for entry in categories]
+    for entry in cate_dict:
+        items = session.query(Item).filter_by(
+            category_id=entry["id"]).order_by(Item.name).all()
+        entry["Item"] = [item.serialize for item in items]
+    return cate_dict
+
+
+def benchExport(args):
+    """
+    Benchmark the catalog export against the legacy per-category export and
+    check that the number of queries stays constant.
+    """
+    engine = create_engine(DATABASE_URL)
+    seedCatalog(engine, args.categories, args.items, force=args.force)
+    DBSession = sessionmaker(bind=engine)
+
+    results = {}
+    for name, func in (("legacy", legacyExport),
+                       ("single-pass", exportCatalog)):
+        session = DBSession()
+        with QueryCounter(engine) as counter:
+            start = time.perf_counter()
+            export = func(session)
+            elapsed = time.perf_counter() - start
+        session.close()
+        results[name] = export
+        print("{0:12} categories={1} queries={2} time={3:.3f}s".format(
+            name, len(export), counter.count, elapsed))
+
+    if results["legacy"] != results["single-pass"]:
+        print("single-pass export does not match the legacy export")
+        return 1
+    return 0
+
+
+# The number of SQL statements each listing page is allowed to issue once
+# the caches are warm. These must not grow with the number of items on the
+# page.
+PAGE_QUERY_BUDGET = {
+    "/catalog/": 1,
+    "/catalog/category/1/": 2,
+}
+
+
+def benchPages(args):
+    """
+    Render the HTML listing pages and count the SQL statements each one
+    issues, failing if a page goes over its PAGE_QUERY_BUDGET.
+    """
+    engine = create_engine(DATABASE_URL)
+    seedCatalog(engine, args.categories, args.items, force=args.force)
+    import catalogApp
+    client = benchApp().test_client()
+
+    status = 0
+    for url, budget in sorted(PAGE_QUERY_BUDGET.items()):
+        client.get(url)
+        with QueryCounter(catalogApp.engine) as counter:
+            start = time.perf_counter()
+            response = client.get(url)
+            elapsed = time.perf_counter() - start
+        print("{0:24} status={1} queries={2} budget={3} time={4:.3f}s".format(
+            url, response.status_code, counter.count, budget, elapsed))
+        if response.status_code != 200 or counter.count > budget:
+            status = 1
+    return status
+
+
+def timeLookups(session, args, repeat):
+    """
+    Time each of the hot lookups, returning the mean latency of each in ms.
+    """
+    lookups = (
+        ("Item.name", lambda n: session.query(Item).filter_by(
+            name="item{0:06d}-000".format(n % args.categories)).first()),
+        ("Category.name", lambda n: session.query(Category).filter_by(
+            name="category{0:06d}".format(n % args.categories)).first()),
+        ("Item.category_id", lambda n: session.query(Item.id).filter_by(
+            category_id=(n % args.categories) + 1).count()),
+        ("User.email", lambda n: session.query(User).filter_by(
+            email=userEmail(n % args.users)).first()),
+    )
+    results = {}
+    for name, lookup in lookups:
+        start = time.perf_counter()
+        for n in range(repeat):
+            lookup(n * 7919)
+        results[name] = (time.perf_counter() - start) * 1000 / repeat
+    return results
+
+
+def benchLookups(args):
+    """
+    Compare the latency of the hot lookups with and without the indexes
+    declared in models.py.
+    """
+    engine = create_engine(DATABASE_URL)
+    print("seeding {0} items".format(args.categories * args.items))
+    seedCatalog(engine, args.categories, args.items, args.users,
+                force=args.force)
+    session = sessionmaker(bind=engine)()
+    indexes = [index for table in Base.metadata.sorted_tables
+               for index in table.indexes]
+
+    for index in indexes:
+        index.drop(engine)
+    before = timeLookups(session, args, args.repeat)
+    for index in indexes:
+        index.create(engine)
+    after = timeLookups(session, args, args.repeat)
+    session.close()
+
+    for name in before:
+        print("{0:18} unindexed={1:9.3f}ms indexed={2:7.3f}ms".format(
+            name, before[name], after[name]))
+    return 0
+
+
+def benchConcurrency(args):
+    """
+    Drive the app from a growing number of threads, each with its own client,
+    and report the throughput. Every response is checked against the item it
+    asked for so that any cross-request leakage of session state is caught.
+    """
+    engine = create_engine(DATABASE_URL)
+    seedCatalog(engine, args.categories, args.items, force=args.force)
+    app = benchApp()
+    itemCount = args.categories * args.items
+
+    status = 0
+    for threads in args.threads:
+        errors = []
+
+        def worker(offset):
+            client = app.test_client()
+            for n in range(args.requests):
+                itemId = ((offset + n * threads) % itemCount) + 1
+                if n % 10 == 0:
+                    response = client.get("/catalog/")
+                    if response.status_code != 200:
+                        errors.append("/catalog/ {0}".format(
+                            response.status_code))
+                    continue
+                response = client.get("/catalog/item/{0}/JSON".format(itemId))
+                if response.status_code != 200 or \
+                        response.get_json()["Item"]["id"] != itemId:
+                    errors.append("item {0} got {1}".format(
+                        itemId, response.get_data(as_text=True)[:80]))
+
+        workers = [threading.Thread(target=worker, args=(t,))
+                   for t in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        total = threads * args.requests
+        print("threads={0:3} requests={1:6} req/s={2:9.1f} errors={3}".format(
+            threads, total, total / elapsed, len(errors)))
+        for error in errors[:5]:
+            print("    {0}".format(error))
+        if errors:
+            status = 1
+    return status
+
+
+def benchEdit(args):
+    """
+    Count the SQL statements and time taken by each kind of item edit, and
+    check that edits leave the item_id alone.
+    """
+    engine = create_engine(DATABASE_URL)
+    seedCatalog(engine, 3, 2, force=args.force)
+    import catalogApp
+    client = benchApp().test_client()
+    loginClient(client)
+
+    edits = (
+        ("same category", 1, "category000000"),
+        ("existing category", 1, "category000001"),
+        ("new category", 3, "category-new"),
+        ("empties old category", 2, "category-new"),
+    )
+    status = 0
+    for name, itemId, category in edits:
+        url = "/catalog/item/{0}/edit".format(itemId)
+        with QueryCounter(catalogApp.engine) as counter:
+            start = time.perf_counter()
+            client.post(url, data={"category": category,
+                                   "description": name})
+            elapsed = time.perf_counter() - start
+        item = client.get("/catalog/item/{0}/JSON".format(itemId)).get_json()
+        moved = item is not None and item["Item"]["description"] == name
+        print("{0:22} queries={1:2} time={2:.3f}s id kept={3}".format(
+            name, counter.count, elapsed, moved))
+        if not moved:
+            status = 1
+    return status
+
+
+# Catalog sizes for the route suite, as (categories, items per category,
+# users)
+SIZES = {
+    "1k": (50, 20, 10),
+    "100k": (1000, 100, 200),
+    "1m": (10000, 100, 1000),
+}
+
+
+def percentile(samples, fraction):
+    """
+    The nearest-rank percentile of a sorted list of samples.
+    """
+    if not samples:
+        return 0.0
+    rank = max(0, min(len(samples) - 1,
+                      int(round(fraction * len(samples) + 0.5)) - 1))
+    return samples[rank]
+
+
+def routeScenarios(args, client, itemIdFor):
+    """
+    The requests driven by the route suite, as (name, function) pairs. Each
+    function issues one request given the iteration number and returns the
+    response.
+    """
+    categories, itemsPerCategory, users = SIZES[args.size]
+    itemCount = categories * itemsPerCategory
+    rng = random.Random(args.seed)
+    prefix = "bench-{0}".format(os.getpid())
+
+    def edit(n):
+        return client.post("/catalog/item/{0}/edit".format(itemIdFor(n)),
+                           data={"category": "category000001",
+                                 "description": "edited"})
+
+    def delete(n):
+        return client.post("/catalog/item/{0}/delete".format(itemIdFor(n)))
+
+    return (
+        ("showItems", lambda n: client.get("/catalog/")),
+        ("showItemsForCategory", lambda n: client.get(
+            "/catalog/category/{0}/".format(rng.randint(1, categories)))),
+        ("allItemsByAllCategoryJSON", lambda n: client.get("/catalog/JSON")),
+        ("allCategoriesJSON", lambda n: client.get("/catalog/category/JSON")),
+        ("itemDetailsJSON", lambda n: client.get(
+            "/catalog/item/{0}/JSON".format(rng.randint(1, itemCount)))),
+        ("searchItemsJSON", lambda n: client.get(
+            "/catalog/search/JSON", query_string={
+                "q": "item{0:06d}".format(rng.randint(0, categories - 1))})),
+        ("newItem", lambda n: client.post(
+            "/catalog/item/new/",
+            data={"name": "{0}-{1}".format(prefix, n),
+                  "category": "bench-category-{0}".format(n % 10),
+                  "description": "created by the benchmark"})),
+        ("editItem", edit),
+        ("deleteItem", delete),
+    )
+
+
+def benchRoutes(args):
+    """
+    Drive every catalogApp route against a synthetic catalog and write the
+    latency percentiles, throughput and SQL statements per request out as
+    JSON, so that runs can be compared with 'benchmark.py compare'.
+    """
+    categories, itemsPerCategory, users = SIZES[args.size]
+    engine = create_engine(DATABASE_URL)
+    if not args.reuse:
+        print("seeding {0} items".format(categories * itemsPerCategory),
+              file=sys.stderr)
+        seedCatalog(engine, categories, itemsPerCategory, users,
+                    force=args.force)
+    import catalogApp
+    client = benchApp().test_client()
+    loginClient(client)
+    lookup = sessionmaker(bind=engine)()
+    prefix = "bench-{0}".format(os.getpid())
+
+    def itemIdFor(n):
+        # the item made by the newItem scenario on iteration n
+        return lookup.query(Item.id).filter_by(
+            name="{0}-{1}".format(prefix, n)).scalar()
+
+    routes = {}
+    for name, request in routeScenarios(args, client, itemIdFor):
+        if args.routes and name not in args.routes:
+            continue
+        requests = args.json_requests if name == "allItemsByAllCategoryJSON" \
+            else args.requests
+        samples = []
+        statements = 0
+        errors = 0
+        for n in range(requests):
+            with QueryCounter(catalogApp.engine) as counter:
+                start = time.perf_counter()
+                response = request(n)
+                samples.append((time.perf_counter() - start) * 1000)
+            statements += counter.count
+            if response.status_code >= 400:
+                errors += 1
+        samples.sort()
+        total = sum(samples) / 1000
+        routes[name] = {
+            "requests": requests,
+            "errors": errors,
+            "p50_ms": percentile(samples, 0.50),
+            "p95_ms": percentile(samples, 0.95),
+            "p99_ms": percentile(samples, 0.99),
+            "throughput_rps": requests / total if total else 0.0,
+            "sql_per_request": statements / float(requests)
+            if requests else 0.0,
+        }
+        print("{0:26} p50={1:8.2f}ms p95={2:8.2f}ms p99={3:8.2f}ms "
+              "rps={4:8.1f} sql/req={5:5.1f} errors={6}".format(
+                  name, routes[name]["p50_ms"], routes[name]["p95_ms"],
+                  routes[name]["p99_ms"], routes[name]["throughput_rps"],
+                  routes[name]["sql_per_request"], errors), file=sys.stderr)
+    lookup.close()
+
+    report = {
+        "meta": {
+            "size": args.size,
+            "categories": categories,
+            "items": categories * itemsPerCategory,
+            "users": users,
+            "database": engine.dialect.name,
+            "python": platform.python_version(),
+            "time": datetime.datetime.utcnow().isoformat() + "Z",
+        },
+        # ru_maxrss is in kilobytes on linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "routes": routes,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as stream:
+            stream.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+def benchCompare(args):
+    """
+    Compare two route suite reports, printing the change in each metric.
+    """
+    with open(args.before) as stream:
+        before = json.load(stream)
+    with open(args.after) as stream:
+        after = json.load(stream)
+    metrics = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps",
+               "sql_per_request")
+    for name in sorted(set(before["routes"]) & set(after["routes"])):
+        print(name)
+        for metric in metrics:
+            old = before["routes"][name][metric]
+            new = after["routes"][name][metric]
+            change = (new - old) / old * 100 if old else 0.0
+            print("    {0:16} {1:10.2f} -> {2:10.2f} ({3:+.1f}%)".format(
+                metric, old, new, change))
+    print("peak_rss_kb      {0} -> {1}".format(before["peak_rss_kb"],
+                                              after["peak_rss_kb"]))
+    return 0
+
+
+def emitRequestLogs(n, eager):
+    """
+    The logging a typical write request does, with the messages either built
+    eagerly with str.format (as catalogApp.py used to) or left to logging.
+    """
+    name = "item{0}".format(n)
+    if eager:
+        logging.debug("attempting to add item - {0}".format(name))
+        logging.debug("{0} items left in category {1}".format(n, name))
+        logging.debug("Item {0} was added".format(name))
+    else:
+        logging.debug("attempting to add item - %s", name)
+        logging.debug("%s items left in category %s", n, name)
+        logging.debug("Item %s was added", name)
+
+
+def benchLogging(args):
+    """
+    Measure the time a request thread spends logging under the old
+    synchronous basicConfig set up and under logConfig's queue based one.
+    """
+    from logConfig import configureLogging, stopLogging
+    root = logging.getLogger()
+    logDir = tempfile.mkdtemp()
+    devnull = open(os.devnull, "w")
+
+    def reset():
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+            handler.close()
+
+    def legacy(level):
+        reset()
+        handler = logging.FileHandler(os.path.join(logDir, "legacy.log"))
+        root.addHandler(handler)
+        root.addHandler(logging.StreamHandler(devnull))
+        root.setLevel(level)
+        return None
+
+    def queued(level):
+        reset()
+        os.environ["CATALOG_LOG_LEVEL"] = level
+        os.environ["CATALOG_LOG_CONSOLE"] = "0"
+        return configureLogging(logDir)
+
+    setups = (
+        ("basicConfig DEBUG, str.format", legacy, "DEBUG", True),
+        ("queue DEBUG, lazy %", queued, "DEBUG", False),
+        ("queue INFO, lazy %", queued, "INFO", False),
+    )
+    for name, setup, level, eager in setups:
+        listener = setup(level)
+        start = time.perf_counter()
+        for n in range(args.requests):
+            emitRequestLogs(n, eager)
+        elapsed = time.perf_counter() - start
+        if listener is not None:
+            stopLogging(listener)
+        print("{0:32} {1:8.2f}us per request".format(
+            name, elapsed * 1e6 / args.requests))
+    reset()
+    devnull.close()
+    shutil.rmtree(logDir)
+    return 0
+
+
+def searchVocabulary(size, seed):
+    """
+    A list of made up words for the search benchmark's descriptions.
+    """
+    rng = random.Random(seed)
+    syllables = ["ba", "ko", "ri", "mu", "te", "la", "zo", "pe", "ni", "da",
+                 "fu", "sa", "ve", "go", "hi", "ju"]
+    words = []
+    while len(words) < size:
+        word = "".join(rng.choice(syllables)
+                       for _ in range(rng.randint(2, 4)))
+        if word not in words:
+            words.append(word)
+    return words
+
+
+def benchSearch(args):
+    """
+    Time building the search index and answering searches with it, for the
+    index suited to the DB and for the in-process fallback. Descriptions are
+    made up from a skewed vocabulary so that both rare and very common words
+    can be searched for.
+    """
+    engine = create_engine(DATABASE_URL)
+    vocabulary = searchVocabulary(args.vocabulary, args.seed)
+    rng = random.Random(args.seed)
+
+    def describe(n):
+        # cubing favours the start of the vocabulary, like real text does
+        return " ".join(vocabulary[int(len(vocabulary) * rng.random() ** 3)]
+                        for _ in range(8))
+
+    print("seeding {0} items".format(args.categories * args.items))
+    seedCatalog(engine, args.categories, args.items, describe=describe,
+                force=args.force)
+    session = sessionmaker(bind=engine)()
+    queries = (
+        ("common word", vocabulary[0]),
+        ("rare word", vocabulary[-1]),
+        ("two words", "{0} {1}".format(vocabulary[1], vocabulary[20])),
+        ("item name", "item{0:06d}-000".format(args.categories // 2)),
+        ("no match", "nosuchword"),
+    )
+
+    indexes = [createSearchIndex(engine)]
+    if not isinstance(indexes[0], MemorySearch):
+        indexes.append(MemorySearch())
+    for index in indexes:
+        start = time.perf_counter()
+        index.install(engine)
+        if isinstance(index, MemorySearch):
+            index.rebuild(session)
+        print("{0:8} built in {1:.2f}s".format(
+            index.name, time.perf_counter() - start))
+        for label, query in queries:
+            samples = []
+            for n in range(args.repeat):
+                start = time.perf_counter()
+                hits = index.search(session, query, args.limit)
+                samples.append((time.perf_counter() - start) * 1000)
+            samples.sort()
+            print("{0:8} {1:12} hits={2:4} p50={3:8.3f}ms p95={4:8.3f}ms"
+                  .format(index.name, label, len(hits),
+                          percentile(samples, 0.50),
+                          percentile(samples, 0.95)))
+    session.close()
+    return 0
+
+
+def benchSerializers(args):
+    """
+    Compare the encode time and payload size of the full catalog export for
+    every encoder installed, against the stdlib encoder as jsonify uses it.
+    """
+    import gzip
+    import serializers
+
+    engine = create_engine(DATABASE_URL)
+    print("seeding {0} items".format(args.categories * args.items))
+    seedCatalog(engine, args.categories, args.items, force=args.force)
+    session = sessionmaker(bind=engine)()
+    document = {"Category": exportCatalog(session)}
+    session.close()
+
+    encoders = [
+        ("json pretty", lambda obj: serializers._stdlibDumps(obj, False)),
+        ("json compact", lambda obj: serializers._stdlibDumps(obj, True)),
+    ]
+    for name, dumps in serializers.ENCODERS:
+        if name != "json":
+            encoders.append((name, lambda obj, dumps=dumps: dumps(obj, True)))
+    if serializers.msgpack is not None:
+        encoders.append(("msgpack", serializers.dumpsMsgpack))
+    else:
+        print("msgpack is not installed")
+
+    baseline = None
+    for name, dumps in encoders:
+        timings = []
+        for n in range(args.repeat):
+            start = time.perf_counter()
+            body = dumps(document)
+            timings.append(time.perf_counter() - start)
+        best = min(timings) * 1000
+        baseline = baseline or best
+        print("{0:13} encode={1:8.1f}ms ({2:5.1f}x) size={3:9} "
+              "gzipped={4:8}".format(name, best, baseline / best, len(body),
+                                     len(gzip.compress(body, 6))))
+    return 0
+
+
+def benchBatch(args):
+    """
+    Compare the throughput, in operations per second, of syncing items one
+    form POST at a time with that of the batch item API. Each run creates,
+    edits and then deletes the same set of items.
+    """
+    engine = create_engine(DATABASE_URL)
+    seedCatalog(engine, args.categories, 10, force=args.force)
+    import catalogApp
+    client = benchApp().test_client()
+    loginClient(client)
+    lookup = sessionmaker(bind=engine)()
+    count = args.operations // 3
+
+    def itemIds(prefix):
+        return [itemId for itemId, in lookup.query(Item.id).filter(
+            Item.name.like(prefix + "%")).order_by(Item.id)]
+
+    def post(url, data=None):
+        client.post(url, data=data)
+        # the redirect that would show the flashed message isn't followed,
+        # so drop the messages before they outgrow the session cookie
+        with client.session_transaction() as login_session:
+            login_session.pop("_flashes", None)
+
+    def forms(prefix):
+        for n in range(count):
+            post("/catalog/item/new/", data={
+                "name": "{0}{1}".format(prefix, n),
+                "category": "sync-{0}".format(n % args.categories),
+                "description": "synced"})
+        for itemId in itemIds(prefix):
+            post("/catalog/item/{0}/edit".format(itemId), data={
+                "category": "category000000", "description": "resynced"})
+        for itemId in itemIds(prefix):
+            post("/catalog/item/{0}/delete".format(itemId))
+
+    def batches(prefix):
+        def send(operations):
+            for start in range(0, len(operations), args.batch_size):
+                response = client.post("/catalog/items/batch", json={
+                    "operations": operations[start:start + args.batch_size]})
+                failed = [result for result in response.get_json()["results"]
+                          if result["status"] >= 400]
+                if failed:
+                    raise RuntimeError("batch failed: {0}".format(failed[0]))
+        send([{"op": "create", "name": "{0}{1}".format(prefix, n),
+               "category": "sync-{0}".format(n % args.categories),
+               "description": "synced"} for n in range(count)])
+        ids = itemIds(prefix)
+        send([{"op": "update", "id": itemId, "category": "category000000",
+               "description": "resynced"} for itemId in ids])
+        send([{"op": "delete", "id": itemId} for itemId in ids])
+
+    for name, run in (("form posts", forms), ("batch API", batches)):
+        lookup.expire_all()
+        with QueryCounter(catalogApp.engine) as counter:
+            start = time.perf_counter()
+            run("{0}-{1}-".format(name.split()[0], os.getpid()))
+            elapsed = time.perf_counter() - start
+        operations = count * 3
+        print("{0:10} ops={1} time={2:7.2f}s ops/sec={3:8.1f} "
+              "sql/op={4:5.2f}".format(name, operations, elapsed,
+                                      operations / elapsed,
+                                      counter.count / float(operations)))
+    lookup.close()
+    return 0
+
+
+def benchReplicas(args):
+    """
+    Check how GET traffic is spread over the read replicas, that a client
+    reads its own writes straight after making them and that reads carry on
+    when a replica goes away. With a sqlite DB the replicas are copies of the
+    seeded file, otherwise CATALOG_REPLICA_URLS must list real replicas.
+    """
+    engine = create_engine(DATABASE_URL)
+    seedCatalog(engine, args.categories, args.items, force=args.force)
+    copies = []
+    replicaUrls = REPLICA_URLS
+    if not replicaUrls:
+        if engine.url.get_backend_name() != "sqlite":
+            print("set CATALOG_REPLICA_URLS to the replicas of the DB")
+            return 1
+        copies = ["{0}.replica{1}".format(engine.url.database, n)
+                  for n in range(args.replicas)]
+        replicaUrls = ["sqlite:///" + path for path in copies]
+    import catalogApp
+    client = benchApp({"REPLICA_URLS": replicaUrls}).test_client()
+    # copied once the schema is complete (ie the search index), as
+    # replication would
+    for path in copies:
+        shutil.copy(engine.url.database, path)
+    engines = [catalogApp.engine] + catalogApp.replicaSet.engines
+    itemCount = args.categories * args.items
+    urls = ["/catalog/", "/catalog/category/JSON",
+            "/catalog/search/JSON?q=item"]
+
+    def reads(count):
+        counters = [QueryCounter(e).__enter__() for e in engines]
+        errors = 0
+        start = time.perf_counter()
+        for n in range(count):
+            url = urls[n % len(urls)] if n % 4 else \
+                "/catalog/item/{0}/JSON".format(n % itemCount + 1)
+            if client.get(url).status_code != 200:
+                errors += 1
+        elapsed = time.perf_counter() - start
+        for counter in counters:
+            counter.__exit__(None, None, None)
+        print("    requests={0} req/s={1:8.1f} errors={2}".format(
+            count, count / elapsed, errors))
+        for e, counter in zip(engines, counters):
+            print("    {0:50} statements={1}".format(str(e.url),
+                                                      counter.count))
+
+    print("reads")
+    reads(args.requests)
+
+    print("read your writes")
+    loginClient(client)
+    name = "replica-{0}".format(os.getpid())
+    client.post("/catalog/item/new/", data={
+        "name": name, "category": "category000000", "description": "new"})
+    found = client.get("/catalog/search/JSON?q=" + name).get_json()["Item"]
+    print("    item visible straight after the write: {0}".format(
+        bool(found)))
+    with client.session_transaction() as login_session:
+        login_session.clear()
+
+    if copies:
+        print("replica {0} unreachable".format(copies[0]))
+        os.rename(copies[0], copies[0] + ".down")
+        os.mkdir(copies[0])
+        reads(args.requests)
+        os.rmdir(copies[0])
+        os.rename(copies[0] + ".down", copies[0])
+        for path in copies:
+            os.remove(path)
+    return 0
+
+
+def benchCompression(args):
+    """
+    Measure, at each catalog size, what compressing the listing page and the
+    JSON dumps costs in CPU time against the bytes it saves, for each
+    encoder and level, and the end to end effect through the middleware,
+    with and without its compressed body cache.
+    """
+    import catalogApp
+    import compression
+    # the catalog is seeded for each size below, and nothing here searches
+    app = catalogApp.createApp()
+    settings = [("gzip", level) for level in (1, 6, 9)]
+    if compression.brotli is not None:
+        settings += [("br", quality) for quality in (1, 5, 9)]
+    middleware = app.wsgi_app
+    if not isinstance(middleware, compression.CompressionMiddleware):
+        print("compression is turned off (CATALOG_COMPRESS)")
+        return 1
+    client = app.test_client()
+    routes = ["/catalog/", "/catalog/JSON", "/catalog/JSON?stream=1"]
+
+    for size in args.sizes:
+        seedCatalog(create_engine(DATABASE_URL), *SIZES[size],
+                    force=args.force)
+        catalogApp.invalidateCaches()
+        print("size={0}".format(size))
+        for route in routes:
+            body = client.get(route).get_data()
+            print("  {0} bytes={1}".format(route, len(body)))
+            for encoding, level in settings:
+                start = time.process_time()
+                for n in range(args.repeat):
+                    compressed = compression.compressBody(
+                        body, encoding, gzipLevel=level, brotliQuality=level)
+                cpu = (time.process_time() - start) / args.repeat
+                saved = len(body) - len(compressed)
+                print("    {0:4}{1:<3} bytes={2:10} saved={3:6.1%} "
+                      "cpu={4:8.2f}ms KB saved/cpu ms={5:8.1f}".format(
+                          encoding, level, len(compressed),
+                          saved / float(len(body)), cpu * 1000,
+                          saved / 1024.0 / max(cpu * 1000, 0.001)))
+
+            for name, acceptEncoding, cached in (
+                    ("identity", "", False), ("gzip", "gzip", False),
+                    ("gzip cached", "gzip", True), ("br", "br", False),
+                    ("br cached", "br", True)):
+                if acceptEncoding == "br" and compression.brotli is None:
+                    continue
+                samples = []
+                for n in range(args.repeat):
+                    if not cached and middleware.cache is not None:
+                        middleware.cache.clear()
+                    start = time.perf_counter()
+                    response = client.get(route, headers={
+                        "Accept-Encoding": acceptEncoding})
+                    sent = len(response.get_data())
+                    samples.append(time.perf_counter() - start)
+                print("    {0:12} p50={1:8.2f}ms sent={2}".format(
+                    name, percentile(samples, 0.5) * 1000, sent))
+    return 0
+
+
+# Run in a fresh interpreter by benchStartup, it loads the app through the
+# WSGI entry point the way mod_wsgi does and serves one request
+STARTUP_PROBE = """
+import time
+start = time.perf_counter()
+import json, runpy, sys
+import catalogApp
+imported = time.perf_counter()
+application = runpy.run_path(sys.argv[1])["application"]
+created = time.perf_counter()
+status = application.test_client().get("/catalog/").status_code
+served = time.perf_counter()
+print(json.dumps({"import": imported - start, "create": created - imported,
+                  "request": served - created, "status": status}))
+"""
+
+
+def startupRun(databaseUrl):
+    """
+    Start a fresh WSGI process against a DB and time it up to its first
+    response, returning the probe's timings with the process total added.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, CATALOG_DATABASE_URL=databaseUrl,
+               CATALOG_LOG_CONSOLE="0",
+               PYTHONPATH=os.pathsep.join(
+                   filter(None, [here, os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    probe = subprocess.run(
+        [sys.executable, "-c", STARTUP_PROBE,
+         os.path.join(here, "myapp.wsgi")], env=env, stdout=subprocess.PIPE,
+        check=True, universal_newlines=True)
+    timings = json.loads(probe.stdout.strip().splitlines()[-1])
+    timings["process"] = time.perf_counter() - start
+    return timings
+
+
+def benchStartup(args):
+    """
+    Measure the time to first request of a fresh WSGI process - importing
+    the app, creating it and serving the listing page - and check that a
+    process still starts when the DB can't be reached.
+    """
+    engine = create_engine(DATABASE_URL)
+    seedCatalog(engine, args.categories, args.items, force=args.force)
+    createSearchIndex(engine).install(engine)
+    databaseUrl = str(engine.url)
+    if engine.url.get_backend_name() == "sqlite":
+        # the processes don't necessarily start in the same directory
+        databaseUrl = "sqlite:///" + os.path.abspath(engine.url.database)
+
+    runs = [startupRun(databaseUrl) for n in range(args.runs)]
+    for step in ("import", "create", "request", "process"):
+        samples = sorted(run[step] * 1000 for run in runs)
+        print("{0:8} p50={1:8.1f}ms min={2:8.1f}ms max={3:8.1f}ms".format(
+            step, percentile(samples, 0.5), samples[0], samples[-1]))
+    print("first request status={0}".format(
+        ",".join(sorted(set(str(run["status"]) for run in runs)))))
+
+    unreachable = startupRun(args.unreachable)
+    print("unreachable DB: import={0:.1f}ms create={1:.1f}ms first request "
+          "status={2}".format(unreachable["import"] * 1000,
+                              unreachable["create"] * 1000,
+                              unreachable["status"]))
+    return 0
+
+
+# Run by benchAsgi, each in a process of its own, they print the port they
+# listen on once they are ready. The WSGI app is served from a thread per
+# request, the ASGI app from uvicorn's event loop.
+WSGI_SERVER = """
+from werkzeug.serving import make_server
+import catalogApp
+server = make_server("127.0.0.1", 0, catalogApp.createApp(), threaded=True)
+server.socket.listen(4096)
+print(server.server_port, flush=True)
+server.serve_forever()
+"""
+ASGI_SERVER = """
+import socket, uvicorn
+# with the protocol given, asyncio turns Nagle off on the connections
+sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+sock.bind(("127.0.0.1", 0))
+sock.listen(4096)
+print(sock.getsockname()[1], flush=True)
+uvicorn.Server(uvicorn.Config("asyncApi:createAsyncApp", factory=True,
+                              log_level="warning", backlog=4096)).run(
+    sockets=[sock])
+"""
+
+
+def startServer(script, databaseUrl):
+    """
+    Start one of the servers above against a DB, returning the process and
+    the port it listens on.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, CATALOG_DATABASE_URL=databaseUrl,
+               CATALOG_LOG_CONSOLE="0",
+               PYTHONPATH=os.pathsep.join(
+                   filter(None, [here, os.environ.get("PYTHONPATH")])))
+    server = subprocess.Popen([sys.executable, "-c", script], env=env,
+                              stdout=subprocess.PIPE,
+                              universal_newlines=True)
+    return server, int(server.stdout.readline())
+
+
+async def readResponse(reader):
+    """
+    Read one HTTP/1.1 response, returning its status, headers (by lower case
+    name) and body.
+    """
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    status = int(lines[0].split()[1])
+    if "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    elif headers.get("transfer-encoding") == "chunked":
+        body = b""
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            body += (await reader.readexactly(size + 2))[:size]
+            if not size:
+                break
+    elif status in (204, 304):
+        body = b""
+    else:
+        body = await reader.read()
+        headers["connection"] = "close"
+    return status, headers, body
+
+
+def httpRequest(url, headers):
+    return "GET {0} HTTP/1.1\r\nHost: localhost\r\n{1}\r\n".format(
+        url, "".join("{0}: {1}\r\n".format(name, value)
+                     for name, value in headers.items())).encode("latin-1")
+
+
+async def fetch(port, url, headers):
+    """
+    Issue a single GET, returning its status, headers and body.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(httpRequest(url, dict(headers, Connection="close")))
+    try:
+        return await readResponse(reader)
+    finally:
+        writer.close()
+
+
+async def pollServer(port, urls, concurrency, requests, etags):
+    """
+    Poll a server over concurrency keep-alive connections until requests
+    have been answered, returning the latencies and the number of errors.
+    When etags are given each poll is conditional, as a client holding the
+    current state would send it.
+    """
+    latencies = []
+    errors = []
+
+    async def poller(offset):
+        reader = writer = None
+        for n in range(offset, requests, concurrency):
+            url = urls[n % len(urls)]
+            headers = {"Accept": "application/json"}
+            if url in etags:
+                headers["If-None-Match"] = etags[url]
+            start = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(
+                        "127.0.0.1", port)
+                writer.write(httpRequest(url, headers))
+                status, responseHeaders, body = await readResponse(reader)
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                errors.append(url)
+                if writer is not None:
+                    writer.close()
+                writer = None
+                continue
+            latencies.append(time.perf_counter() - start)
+            if status not in (200, 304):
+                errors.append(url)
+            if responseHeaders.get("connection") == "close":
+                writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    await asyncio.gather(*[poller(n) for n in range(concurrency)])
+    return latencies, len(errors)
+
+
+def benchAsgi(args):
+    """
+    Compare how the WSGI app and the ASGI JSON API (see asyncApi.py) scale
+    with the number of clients polling the JSON routes at once, after
+    checking that both send the same responses. The gap is widest against a
+    DB the requests have to wait on, ie postgres over the network, rather
+    than a local sqlite file.
+    """
+    engine = create_engine(DATABASE_URL)
+    seedCatalog(engine, args.categories, args.items, force=args.force)
+    databaseUrl = str(engine.url)
+    if engine.url.get_backend_name() == "sqlite":
+        databaseUrl = "sqlite:///" + os.path.abspath(engine.url.database)
+    # every poller holds a socket open at each end
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    itemCount = args.categories * args.items
+    urls = ["/catalog/JSON", "/catalog/category/JSON"] + [
+        "/catalog/item/{0}/JSON".format(n * 7919 % itemCount + 1)
+        for n in range(8)]
+    servers = dict((name, startServer(script, databaseUrl)) for name, script
+                   in (("wsgi", WSGI_SERVER), ("asgi", ASGI_SERVER)))
+    status = 0
+    try:
+        etags = {}
+        for url in urls + ["/catalog/JSON?stream=1",
+                           "/catalog/category/JSON?limit=5"]:
+            responses = [asyncio.run(fetch(servers[name][1], url, {
+                "Accept": "application/json"})) for name in ("wsgi", "asgi")]
+            same = [(response[0], response[2], response[1].get("etag"))
+                    for response in responses]
+            if same[0] != same[1]:
+                print("{0} differs: wsgi={1} asgi={2}".format(
+                    url, same[0][:1], same[1][:1]))
+                status = 1
+            etags[url] = responses[0][1].get("etag")
+        print("responses identical: {0}".format(status == 0))
+
+        for name, (server, port) in sorted(servers.items(), reverse=True):
+            for concurrency in args.concurrency:
+                start = time.perf_counter()
+                latencies, errors = asyncio.run(pollServer(
+                    port, urls, concurrency, args.requests,
+                    etags if args.conditional else {}))
+                elapsed = time.perf_counter() - start
+                latencies.sort()
+                print("{0} concurrency={1:5} req/s={2:8.1f} p50={3:8.2f}ms "
+                      "p99={4:8.2f}ms errors={5}".format(
+                          name, concurrency, len(latencies) / elapsed,
+                          percentile(latencies, 0.5) * 1000,
+                          percentile(latencies, 0.99) * 1000, errors))
+    finally:
+        for server, port in servers.values():
+            server.terminate()
+            server.wait()
+    return status
+
+
+def benchChanges(args):
+    """
+    Compare what a client mirroring the catalog has to download to catch up
+    after a round of writes - the full '/catalog/JSON' dump against paging
+    through '/catalog/changes' from the version it last saw. Each round
+    updates items and replaces a tenth of them (a delete and an insert).
+    """
+    engine = create_engine(DATABASE_URL)
+    seedCatalog(engine, args.categories, args.items, force=args.force)
+    client = benchApp({"COMPRESS": False}).test_client()
+    writer = sessionmaker(bind=engine)()
+    rng = random.Random(args.seed)
+    itemIds = [itemId for itemId, in writer.query(Item.id)]
+
+    def sync(since):
+        url = "/catalog/changes?since={0}&limit=200".format(since)
+        requests = size = 0
+        while True:
+            response = client.get(url)
+            requests += 1
+            size += len(response.data)
+            document = response.get_json()
+            if document["next"] is None:
+                return document["version"], requests, size
+            url = "/catalog/changes?after={0}&limit=200".format(
+                document["next"])
+
+    version, requests, size = sync(0)
+    print("initial sync from 0: requests={0} size={1}".format(requests,
+                                                              size))
+    for changes in args.changes:
+        for n in range(changes):
+            item = writer.query(Item).get(rng.choice(itemIds))
+            if n % 10 == 9:
+                itemIds.remove(item.id)
+                writer.add(Item(name="{0}-new-{1}-{2}".format(
+                    item.name, changes, n), description="replaced",
+                    category_id=item.category_id, user_id=item.user_id))
+                writer.delete(item)
+            else:
+                item.description = "edited {0}-{1}".format(changes, n)
+            if n % 500 == 499 or n == changes - 1:
+                writer.commit()
+        itemIds = [itemId for itemId, in writer.query(Item.id)]
+
+        start = time.perf_counter()
+        full = len(client.get("/catalog/JSON").data)
+        fullTime = time.perf_counter() - start
+        start = time.perf_counter()
+        version, requests, size = sync(version)
+        feedTime = time.perf_counter() - start
+        print("changes={0:6} full: size={1:10} time={2:7.1f}ms   feed: "
+              "size={3:9} requests={4:4} time={5:7.1f}ms".format(
+                  changes, full, fullTime * 1000, size, requests,
+                  feedTime * 1000))
+    writer.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--force", action="store_true",
+                        help="seed (wiping) a DB that is not a sqlite one")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    export = commands.add_parser("export",
+                                 help="catalog JSON export query count")
+    export.add_argument("--categories", type=int, default=5000)
+    export.add_argument("--items", type=int, default=5,
+                        help="items per category")
+    export.set_defaults(func=benchExport)
+
+    pages = commands.add_parser("pages",
+                                help="SQL statements per listing page")
+    pages.add_argument("--categories", type=int, default=50)
+    pages.add_argument("--items", type=int, default=20,
+                       help="items per category")
+    pages.set_defaults(func=benchPages)
+
+    lookups = commands.add_parser("lookups",
+                                  help="hot lookup latency with/without "
+                                       "indexes")
+    lookups.add_argument("--categories", type=int, default=10000)
+    lookups.add_argument("--items", type=int, default=100,
+                         help="items per category")
+    lookups.add_argument("--users", type=int, default=1000)
+    lookups.add_argument("--repeat", type=int, default=50)
+    lookups.set_defaults(func=benchLookups)
+
+    concurrency = commands.add_parser("concurrency",
+                                      help="multi-threaded throughput")
+    concurrency.add_argument("--categories", type=int, default=100)
+    concurrency.add_argument("--items", type=int, default=20,
+                             help="items per category")
+    concurrency.add_argument("--threads", type=int, nargs="+",
+                             default=[1, 2, 4, 8])
+    concurrency.add_argument("--requests", type=int, default=200,
+                             help="requests per thread")
+    concurrency.set_defaults(func=benchConcurrency)
+
+    edit = commands.add_parser("edit", help="SQL statements per item edit")
+    edit.set_defaults(func=benchEdit)
+
+    routes = commands.add_parser("routes", help="latency of every route")
+    routes.add_argument("--size", choices=sorted(SIZES), default="1k")
+    routes.add_argument("--requests", type=int, default=100,
+                        help="requests per route")
+    routes.add_argument("--json-requests", type=int, default=5,
+                        help="requests for the full catalog dump")
+    routes.add_argument("--routes", nargs="+",
+                        help="only run these routes (view names)")
+    routes.add_argument("--reuse", action="store_true",
+                        help="reuse the catalog from a previous run")
+    routes.add_argument("--seed", type=int, default=0)
+    routes.add_argument("--output", help="write the JSON report here")
+    routes.set_defaults(func=benchRoutes)
+
+    compare = commands.add_parser("compare", help="compare two reports")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    compare.set_defaults(func=benchCompare)
+
+    logs = commands.add_parser("logging",
+                               help="logging overhead per request")
+    logs.add_argument("--requests", type=int, default=20000)
+    logs.set_defaults(func=benchLogging)
+
+    search = commands.add_parser("search",
+                                 help="search index build time and latency")
+    search.add_argument("--categories", type=int, default=10000)
+    search.add_argument("--items", type=int, default=100,
+                        help="items per category")
+    search.add_argument("--vocabulary", type=int, default=5000,
+                        help="distinct words used in descriptions")
+    search.add_argument("--repeat", type=int, default=50)
+    search.add_argument("--limit", type=int, default=50)
+    search.add_argument("--seed", type=int, default=0)
+    search.set_defaults(func=benchSearch)
+
+    encoders = commands.add_parser("serializers",
+                                   help="export encode time and size")
+    encoders.add_argument("--categories", type=int, default=5000)
+    encoders.add_argument("--items", type=int, default=20,
+                          help="items per category")
+    encoders.add_argument("--repeat", type=int, default=5)
+    encoders.set_defaults(func=benchSerializers)
+
+    batch = commands.add_parser("batch",
+                                help="form posts vs batch API ops/sec")
+    batch.add_argument("--operations", type=int, default=3000,
+                       help="total of creates, edits and deletes")
+    batch.add_argument("--batch-size", type=int, default=500)
+    batch.add_argument("--categories", type=int, default=20)
+    batch.set_defaults(func=benchBatch)
+
+    replicas = commands.add_parser("replicas",
+                                   help="reads spread over read replicas")
+    replicas.add_argument("--replicas", type=int, default=2,
+                          help="sqlite copies to read from")
+    replicas.add_argument("--requests", type=int, default=1000)
+    replicas.add_argument("--categories", type=int, default=100)
+    replicas.add_argument("--items", type=int, default=10,
+                          help="items per category")
+    replicas.set_defaults(func=benchReplicas)
+
+    compress = commands.add_parser("compression",
+                                   help="compression cost vs bytes saved")
+    compress.add_argument("--sizes", nargs="+", choices=sorted(SIZES),
+                          default=["1k", "100k"])
+    compress.add_argument("--repeat", type=int, default=5)
+    compress.set_defaults(func=benchCompression)
+
+    startup = commands.add_parser("startup",
+                                  help="time to first request of a fresh "
+                                       "WSGI process")
+    startup.add_argument("--runs", type=int, default=10)
+    startup.add_argument("--categories", type=int, default=50)
+    startup.add_argument("--items", type=int, default=20,
+                         help="items per category")
+    startup.add_argument("--unreachable",
+                         default="sqlite:////nonexistent/catalog.db",
+                         help="DB URL that can't be connected to")
+    startup.set_defaults(func=benchStartup)
+
+    asgi = commands.add_parser("asgi",
+                               help="WSGI vs ASGI JSON API under concurrent "
+                                    "polling")
+    asgi.add_argument("--concurrency", type=int, nargs="+",
+                      default=[1, 10, 100, 1000])
+    asgi.add_argument("--requests", type=int, default=5000,
+                      help="requests per concurrency level")
+    asgi.add_argument("--conditional", action="store_true",
+                      help="poll with If-None-Match, mostly getting 304s")
+    asgi.add_argument("--categories", type=int, default=20)
+    asgi.add_argument("--items", type=int, default=10,
+                      help="items per category")
+    asgi.set_defaults(func=benchAsgi)
+
+    changes = commands.add_parser("changes",
+                                  help="full dump vs change feed to catch "
+                                       "up after writes")
+    changes.add_argument("--categories", type=int, default=1000)
+    changes.add_argument("--items", type=int, default=20,
+                         help="items per category")
+    changes.add_argument("--changes", type=int, nargs="+",
+                         default=[0, 10, 100, 1000],
+                         help="writes made before each catch up")
+    changes.add_argument("--seed", type=int, default=0)
+    changes.set_defaults(func=benchChanges)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    except WipeRefused as e:
+        print(e, file=sys.stderr)
+        return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,385 @@
+#!/usr/local/bin/python3
+"""
+The bulkLoad.py module is a standalone module intended to load large catalogs
+into the Catalog Application DB and to export them back out again.
+
+Each record is an item along with the name of its category and the email of
+the user that owns it -
+
+    name, description, category, user_email, user_name (optional)
+
+Records are read from CSV (with a header row) or JSON Lines files and are
+inserted in batches, using COPY on postgres and executemany everywhere else.
+Categories and users are resolved through in-memory maps, unknown ones are
+created on the fly, and an item with no category or user_email is loaded
+without one. Each batch is recorded in the change log (see
+models.recordChanges) like any other write. The export writes the same
+record layout, items without a category or user included, so that a dump
+can be loaded straight back in. Only JSON Lines tells a missing description
+apart from an empty one.
+
+Usage
+=======================================================
+python3 bulkLoad.py import items.csv
+python3 bulkLoad.py import items.jsonl --batch-size 10000
+python3 bulkLoad.py export items.jsonl
+"""
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Item, Category, User, DATABASE_URL, bumpCatalogVersion
+from models import adjustItemCounts, recordChanges
+from datetime import datetime
+from collections import Counter
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+
+FIELDS = ("name", "description", "category", "user_email", "user_name")
+
+
+def guessFormat(path, requested=None):
+    """
+    Function to work out the format of a file from its extension.
+
+    Parameters
+    =======================================================
+    path - string
+        The path of the file.
+    requested - string
+        The format asked for on the command line, if any.
+
+    Returns
+    =======================================================
+    string -
+        Either "csv" or "jsonl".
+    """
+    if requested:
+        return requested
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def readRecords(stream, recordFormat):
+    """
+    Function to read item records from a file one at a time.
+
+    Parameters
+    =======================================================
+    stream - file object
+        The open file to read.
+    recordFormat - string
+        Either "csv" or "jsonl".
+
+    Returns
+    =======================================================
+    generator of dictionaries -
+        The item records.
+    """
+    if recordFormat == "csv":
+        for record in csv.DictReader(stream):
+            yield record
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def copyField(value):
+    """
+    Function to format a value for a COPY ... WITH CSV row. Text is always
+    quoted, so that only a missing value (None) is written as the unquoted
+    empty field that COPY reads as NULL, and an empty description stays
+    empty.
+
+    Parameters
+    =======================================================
+    value - string, int, datetime or None
+        The value of the column.
+
+    Returns
+    =======================================================
+    string -
+        The field to write.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, int):
+        return str(value)
+    return '"{0}"'.format(str(value).replace('"', '""'))
+
+
+def batched(records, size):
+    """
+    Function to group records into lists of at most size records.
+    """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BulkLoader(object):
+    """
+    BulkLoader class to insert item records into the DB in batches.
+
+    Attributes
+    =======================================================
+    engine - sqlalchemy engine
+        The engine for the DB to load.
+    categoryIds - dictionary
+        Category name to Category.id for every known category.
+    userIds - dictionary
+        User email to User.id for every known user.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.usesCopy = engine.dialect.name == "postgresql"
+        with engine.connect() as conn:
+            self.categoryIds = dict(
+                (name, categoryId) for categoryId, name in conn.execute(
+                    Category.__table__.select().with_only_columns(
+                        [Category.id, Category.name])))
+            self.userIds = dict(
+                (email, userId) for userId, email in conn.execute(
+                    User.__table__.select().with_only_columns(
+                        [User.id, User.email])))
+
+    def _resolveCategories(self, conn, batch, now):
+        names = set(record.get("category") for record in batch) - \
+            set(self.categoryIds) - set([None, ""])
+        if not names:
+            return
+        table = Category.__table__
+        conn.execute(table.insert(),
+                     [{"name": name, "updated_at": now} for name in names])
+        for categoryId, name in conn.execute(
+                table.select().with_only_columns(
+                    [table.c.id, table.c.name]).where(
+                        table.c.name.in_(names))):
+            self.categoryIds[name] = categoryId
+
+    def _resolveUsers(self, conn, batch):
+        users = {}
+        for record in batch:
+            email = record.get("user_email")
+            if email and email not in self.userIds:
+                users[email] = record.get("user_name") or email
+        if not users:
+            return
+        table = User.__table__
+        conn.execute(table.insert(),
+                     [{"name": name, "email": email, "picture": ""}
+                      for email, name in users.items()])
+        for userId, email in conn.execute(
+                table.select().with_only_columns(
+                    [table.c.id, table.c.email]).where(
+                        table.c.email.in_(list(users)))):
+            self.userIds[email] = userId
+
+    def _insertItems(self, conn, rows):
+        if not self.usesCopy:
+            conn.execute(Item.__table__.insert(), rows)
+            return
+        columns = ("name", "description", "category_id", "user_id",
+                   "updated_at")
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(",".join(copyField(row[column])
+                                  for column in columns) + "\n")
+        buffer.seek(0)
+        cursor = conn.connection.cursor()
+        cursor.copy_expert(
+            'COPY "Item" ({0}) FROM STDIN WITH CSV'.format(
+                ", ".join(columns)), buffer)
+
+    def _recordChanges(self, conn, batch, deltas, knownCategories):
+        # COPY hands no ids back, the item names are unique though
+        table = Item.__table__
+        itemIds = sorted(itemId for itemId, in conn.execute(
+            table.select().with_only_columns([table.c.id]).where(
+                table.c.name.in_([record["name"] for record in batch]))))
+        newCategories = set(self.categoryIds[name] for name in
+                            set(self.categoryIds) - knownCategories)
+        recordChanges(conn, [
+            ("category", categoryId,
+             "insert" if categoryId in newCategories else "update")
+            for categoryId in sorted(set(deltas) - set([None]))] + [
+            ("item", itemId, "insert") for itemId in itemIds])
+
+    def loadBatch(self, batch):
+        """
+        Function to insert one batch of item records in a single transaction.
+
+        Parameters
+        =======================================================
+        batch - list of dictionaries
+            The item records.
+
+        Returns
+        =======================================================
+        None
+        """
+        now = datetime.utcnow()
+        knownCategories = set(self.categoryIds)
+        knownUsers = set(self.userIds)
+        try:
+            with self.engine.begin() as conn:
+                self._resolveCategories(conn, batch, now)
+                self._resolveUsers(conn, batch)
+                rows = [{"name": record["name"],
+                         "description": record.get("description"),
+                         "category_id": self.categoryIds.get(
+                             record.get("category")),
+                         "user_id": self.userIds.get(
+                             record.get("user_email")),
+                         "updated_at": now} for record in batch]
+                self._insertItems(conn, rows)
+                deltas = Counter(row["category_id"] for row in rows)
+                adjustItemCounts(conn, deltas)
+                bumpCatalogVersion(conn)
+                self._recordChanges(conn, batch, deltas, knownCategories)
+        except:
+            # forget the categories and users that were rolled back
+            for name in set(self.categoryIds) - knownCategories:
+                del self.categoryIds[name]
+            for email in set(self.userIds) - knownUsers:
+                del self.userIds[email]
+            raise
+
+    def load(self, records, batchSize=5000, report=None):
+        """
+        Function to insert a stream of item records batch by batch.
+
+        Parameters
+        =======================================================
+        records - iterable of dictionaries
+            The item records.
+        batchSize - int
+            The number of records to insert per transaction.
+        report - function
+            Called with (rows loaded so far, seconds elapsed) after every
+            batch.
+
+        Returns
+        =======================================================
+        int -
+            The number of records loaded.
+        """
+        start = time.perf_counter()
+        loaded = 0
+        for batch in batched(records, batchSize):
+            self.loadBatch(batch)
+            loaded += len(batch)
+            if report is not None:
+                report(loaded, time.perf_counter() - start)
+        return loaded
+
+
+def exportRecords(session, batchSize=5000):
+    """
+    Function to stream every item out of the DB as item records, reading
+    through a server-side cursor.
+
+    Parameters
+    =======================================================
+    session - sqlalchemy session
+        The session to issue the query with.
+    batchSize - int
+        The number of rows to fetch from the cursor at a time.
+
+    Returns
+    =======================================================
+    generator of dictionaries -
+        The item records ordered by item id, with None for the category or
+        user of an item that has none.
+    """
+    query = session.query(Item.name, Item.description, Category.name,
+                          User.email, User.name).outerjoin(
+        Category, Item.category_id == Category.id).outerjoin(
+        User, Item.user_id == User.id).order_by(Item.id).yield_per(batchSize)
+    for row in query:
+        yield dict(zip(FIELDS, row))
+
+
+def writeRecords(stream, records, recordFormat):
+    """
+    Function to write item records to a file as they are produced.
+
+    Parameters
+    =======================================================
+    stream - file object
+        The open file to write.
+    records - iterable of dictionaries
+        The item records.
+    recordFormat - string
+        Either "csv" or "jsonl".
+
+    Returns
+    =======================================================
+    int -
+        The number of records written.
+    """
+    written = 0
+    if recordFormat == "csv":
+        writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            written += 1
+    else:
+        for record in records:
+            stream.write(json.dumps(record) + "\n")
+            written += 1
+    return written
+
+
+def progress(rows, elapsed):
+    """
+    Function to report the number of rows handled and the rate.
+    """
+    print("{0} rows in {1:.1f}s ({2:.0f} rows/sec)".format(
+        rows, elapsed, rows / elapsed if elapsed else 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("path", help="file to read or write, '-' for stdio")
+    parser.add_argument("--format", choices=("csv", "jsonl"))
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    engine = create_engine(DATABASE_URL)
+    recordFormat = guessFormat(args.path, args.format)
+    start = time.perf_counter()
+
+    if args.command == "import":
+        stream = sys.stdin if args.path == "-" else \
+            open(args.path, "r", newline="")
+        with stream:
+            loaded = BulkLoader(engine).load(
+                readRecords(stream, recordFormat), args.batch_size, progress)
+        progress(loaded, time.perf_counter() - start)
+    else:
+        session = sessionmaker(bind=engine)()
+        stream = sys.stdout if args.path == "-" else \
+            open(args.path, "w", newline="")
+        with stream:
+            written = writeRecords(
+                stream, exportRecords(session, args.batch_size), recordFormat)
+        session.close()
+        if args.path != "-":
+            progress(written, time.perf_counter() - start)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,351 @@
+#!/usr/local/bin/python3
+"""
+The caching.py module is a module intended to hold the in-process caches used
+by the Catalog Application to avoid repeating DB work on every page view.
+
+Each mod_wsgi process keeps its own copy of a cache. Writes made through a
+process invalidate that process's copy straight away, the other processes
+pick the change up once their copy is older than the configured TTL.
+
+Rendered page fragments are keyed by the catalog version instead, so a write
+made by any process makes every older fragment unreachable. They are kept
+either in the process (MemoryFragmentStore) or in a directory shared by all
+the processes (DiskFragmentStore) -
+
+CATALOG_FRAGMENT_CACHE - "memory" (default), "disk" or "off"
+CATALOG_FRAGMENT_CACHE_BYTES - memory cap of the in-process store (32MB)
+CATALOG_FRAGMENT_CACHE_DIR - directory of the disk store (cache/fragments)
+CATALOG_FRAGMENT_CACHE_DISK_BYTES - disk cap of the disk store (256MB)
+"""
+from collections import namedtuple, OrderedDict
+from models import Category
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# A lightweight, session independent stand in for a Category row
+CategoryEntry = namedtuple("CategoryEntry", ["id", "name"])
+
+
+class CategoryCache(object):
+    """
+    CategoryCache class to hold the ordered list of categories that is drawn
+    in the navigation bar of every page.
+
+    Attributes
+    =======================================================
+    ttl - float or None
+        Seconds a loaded list stays valid for, None to keep it until it is
+        invalidated.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = None
+        self._loadedAt = 0.0
+        self._generation = 0
+
+    def get(self, session):
+        """
+        Function to retrieve the categories ordered by name, loading them from
+        the DB only when the cached list is missing or stale.
+
+        Parameters
+        =======================================================
+        session - sqlalchemy session
+            The session to load the categories with on a miss.
+
+        Returns
+        =======================================================
+        list of CategoryEntry -
+            The categories ordered by name.
+        """
+        with self._lock:
+            entries = self._entries
+            generation = self._generation
+            if entries is not None and (
+                    self.ttl is None or
+                    time.monotonic() - self._loadedAt < self.ttl):
+                return entries
+
+        entries = [CategoryEntry(categoryId, name) for categoryId, name in
+                   session.query(Category.id, Category.name).order_by(
+                       Category.name)]
+        with self._lock:
+            # Only keep the list if no write invalidated it while loading
+            if generation == self._generation:
+                self._entries = entries
+                self._loadedAt = time.monotonic()
+        return entries
+
+    def invalidate(self):
+        """
+        Function to drop the cached list after the categories have changed.
+        It must be called after the change has been committed.
+
+        Parameters
+        =======================================================
+        None
+
+        Returns
+        =======================================================
+        None
+        """
+        with self._lock:
+            self._entries = None
+            self._generation += 1
+
+
+class MemoryFragmentStore(object):
+    """
+    MemoryFragmentStore class to keep rendered fragments in the process,
+    dropping the least recently used ones once they take up more than
+    maxBytes.
+
+    Attributes
+    =======================================================
+    maxBytes - int
+        The most memory the fragments may take up.
+    size - int
+        The memory the fragments take up now.
+    """
+
+    def __init__(self, maxBytes=32 * 1024 * 1024):
+        self.maxBytes = maxBytes
+        self.size = 0
+        self._lock = threading.Lock()
+        self._fragments = OrderedDict()
+
+    @staticmethod
+    def _cost(key, fragment):
+        return sys.getsizeof(key) + sys.getsizeof(fragment)
+
+    def get(self, key):
+        """
+        Function to retrieve a fragment.
+
+        Parameters
+        =======================================================
+        key - string
+            The key the fragment was stored under.
+
+        Returns
+        =======================================================
+        string -
+            The fragment, or None if it is not stored.
+        """
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+            return fragment
+
+    def set(self, key, fragment):
+        """
+        Function to store a fragment, evicting the least recently used
+        fragments to make room for it.
+
+        Parameters
+        =======================================================
+        key - string
+            The key to store the fragment under.
+        fragment - string
+            The rendered fragment.
+
+        Returns
+        =======================================================
+        None
+        """
+        cost = self._cost(key, fragment)
+        if cost > self.maxBytes:
+            return
+        with self._lock:
+            previous = self._fragments.pop(key, None)
+            if previous is not None:
+                self.size -= self._cost(key, previous)
+            self._fragments[key] = fragment
+            self.size += cost
+            while self.size > self.maxBytes:
+                oldKey, oldFragment = self._fragments.popitem(last=False)
+                self.size -= self._cost(oldKey, oldFragment)
+
+    def clear(self):
+        """
+        Function to drop every stored fragment.
+        """
+        with self._lock:
+            self._fragments.clear()
+            self.size = 0
+
+
+class DiskFragmentStore(object):
+    """
+    DiskFragmentStore class to keep rendered fragments as files in a
+    directory, so that every mod_wsgi process of the app shares them. Once
+    the fragments take up more than maxBytes the oldest written ones are
+    removed. Each process checks the directory after writing a tenth of
+    maxBytes, so it may briefly run over by that much per process.
+
+    Attributes
+    =======================================================
+    directory - string
+        The directory the fragments are written to.
+    maxBytes - int
+        The most disk space the fragments may take up.
+    """
+
+    def __init__(self, directory, maxBytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self._lock = threading.Lock()
+        self._written = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._prune()
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + ".html")
+
+    def get(self, key):
+        """
+        Function to retrieve a fragment.
+
+        Parameters
+        =======================================================
+        key - string
+            The key the fragment was stored under.
+
+        Returns
+        =======================================================
+        string -
+            The fragment, or None if it is not stored.
+        """
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as stream:
+                return stream.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, key, fragment):
+        """
+        Function to store a fragment. The file is written under a temporary
+        name and then moved into place, so other processes never read a
+        partly written fragment.
+
+        Parameters
+        =======================================================
+        key - string
+            The key to store the fragment under.
+        fragment - string
+            The rendered fragment.
+
+        Returns
+        =======================================================
+        None
+        """
+        handle, temporary = tempfile.mkstemp(dir=self.directory,
+                                             suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w", encoding="utf-8") as stream:
+                stream.write(fragment)
+            os.replace(temporary, self._path(key))
+        except (IOError, OSError):
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return
+        with self._lock:
+            self._written += len(fragment)
+            prune = self._written >= self.maxBytes // 10
+            if prune:
+                self._written = 0
+        if prune:
+            self._prune()
+
+    def _fragments(self):
+        # (mtime, size, path) of every stored fragment
+        fragments = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".html"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed by another process in the meantime
+                continue
+            fragments.append((stat.st_mtime, stat.st_size, path))
+        return fragments
+
+    def _prune(self):
+        fragments = self._fragments()
+        size = sum(fragmentSize for mtime, fragmentSize, path in fragments)
+        if size <= self.maxBytes:
+            return
+        for mtime, fragmentSize, path in sorted(fragments):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= fragmentSize
+            if size <= self.maxBytes:
+                break
+
+    def clear(self):
+        """
+        Function to drop every stored fragment, for every process.
+        """
+        for name in os.listdir(self.directory):
+            if name.endswith(".html"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    # another process got to it first
+                    pass
+
+
+class NullFragmentStore(object):
+    """
+    NullFragmentStore class that stores nothing, for when fragment caching
+    is turned off.
+    """
+
+    def get(self, key):
+        return None
+
+    def set(self, key, fragment):
+        pass
+
+    def clear(self):
+        pass
+
+
+def createFragmentStore():
+    """
+    Function to create the fragment store configured in the environment.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    MemoryFragmentStore, DiskFragmentStore or NullFragmentStore -
+        The store to cache rendered fragments in.
+    """
+    backend = os.environ.get("CATALOG_FRAGMENT_CACHE", "memory")
+    if backend == "off":
+        return NullFragmentStore()
+    if backend == "disk":
+        return DiskFragmentStore(
+            os.environ.get("CATALOG_FRAGMENT_CACHE_DIR",
+                           os.path.join("cache", "fragments")),
+            int(os.environ.get("CATALOG_FRAGMENT_CACHE_DISK_BYTES",
+                               256 * 1024 * 1024)))
+    return MemoryFragmentStore(int(os.environ.get(
+        "CATALOG_FRAGMENT_CACHE_BYTES", 32 * 1024 * 1024)))
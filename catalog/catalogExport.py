@@ -0,0 +1,198 @@
+#!/usr/local/bin/python3
+"""
+The catalogExport.py module is a module intended to build the full catalog
+export (every category along with the items that fall under it) for the
+Catalog Application.
+
+The export is built from a single ordered query that outer joins the
+categories to their items, rather than one query per category, so the number
+of round trips to the DB stays constant no matter how many categories exist.
+The export can also be streamed out one category at a time for catalogs that
+are too large to comfortably build in memory.
+
+The query selects plain columns rather than mapped objects - building an ORM
+instance for every item cost far more than encoding the export did.
+"""
+from models import Item, Category
+
+# Placeholder used to work out how the caller's JSON encoder lays out the
+# document around each category
+_SENTINEL = "__catalogExportSentinel__"
+
+
+def catalogRows(session, categoryIds=None):
+    """
+    Function to build the single ordered query that drives the catalog export.
+
+    Parameters
+    =======================================================
+    session - sqlalchemy session
+        The session to issue the query with.
+    categoryIds - list of int
+        Optionally restrict the export to these categories.
+
+    Returns
+    =======================================================
+    sqlalchemy Query -
+        A query yielding (category id, category name, category item count,
+        item id, item name, item description) rows ordered by category name
+        and then item name. The item columns are None for a category with
+        no items.
+    """
+    query = session.query(Category.id, Category.name, Category.item_count,
+                          Item.id, Item.name, Item.description).outerjoin(
+        Item, Item.category_id == Category.id)
+    if categoryIds is not None:
+        query = query.filter(Category.id.in_(categoryIds))
+    return query.order_by(Category.name, Category.id, Item.name, Item.id)
+
+
+def streamCatalogRows(session, batchSize=1000):
+    """
+    Function to run the catalog export query through a server-side cursor so
+    that rows are fetched from the DB in batches instead of all at once.
+
+    Parameters
+    =======================================================
+    session - sqlalchemy session
+        The session to issue the query with.
+    batchSize - int
+        The number of rows to fetch from the cursor at a time.
+
+    Returns
+    =======================================================
+    sqlalchemy Query -
+        The catalogRows query set up to yield rows in batches.
+    """
+    return catalogRows(session).yield_per(batchSize)
+
+
+def groupCatalogRows(rows):
+    """
+    Function to group the ordered rows into the serialized Category/Item
+    structure, yielding one category at a time.
+
+    Parameters
+    =======================================================
+    rows - iterable
+        The rows as produced by catalogRows.
+
+    Returns
+    =======================================================
+    generator of dictionaries -
+        Each dictionary is a serialized Category with an "Item" entry holding
+        the list of serialized items for that category, laid out exactly as
+        Category.serialize and Item.serialize do.
+    """
+    current = None
+    currentId = None
+    for categoryId, categoryName, itemCount, itemId, itemName, description \
+            in rows:
+        if categoryId != currentId:
+            if current is not None:
+                yield current
+            current = {"id": categoryId, "item_count": itemCount,
+                       "name": categoryName, "Item": []}
+            currentId = categoryId
+        if itemId is not None:
+            current["Item"].append({
+                "cat_id": categoryId,
+                "description": description,
+                "id": itemId,
+                "title": itemName,
+            })
+    if current is not None:
+        yield current
+
+
+def exportCatalog(session, categoryIds=None):
+    """
+    Function to export every category and its items from the DB in one
+    query.
+
+    Parameters
+    =======================================================
+    session - sqlalchemy session
+        The session to issue the query with.
+    categoryIds - list of int
+        Optionally restrict the export to these categories.
+
+    Returns
+    =======================================================
+    list of dictionaries -
+        The serialized categories, ordered by name, each carrying its items
+        under the "Item" key.
+    """
+    return list(groupCatalogRows(catalogRows(session, categoryIds)))
+
+
+class CatalogJSONEncoder(object):
+    """
+    CatalogJSONEncoder class to encode the catalog export incrementally, one
+    category at a time (see streamCatalogJSON).
+
+    The output is byte for byte what dumps({"Category": [...]}) produces for
+    the whole list. Rather than assuming a layout, the document framing and
+    the separator between categories are taken from dumps itself, so any
+    indentation or key ordering it applies is kept.
+
+    Attributes
+    =======================================================
+    dumps - function
+        Function that encodes a whole document to a string.
+    """
+
+    def __init__(self, dumps):
+        self.dumps = dumps
+        placeholder = '"{0}"'.format(_SENTINEL)
+        self._prefix, self._suffix = dumps({"Category": [_SENTINEL]}).split(
+            placeholder)
+        pair = dumps({"Category": [_SENTINEL, _SENTINEL]})
+        self._separator = pair[len(self._prefix) + len(placeholder):
+                               len(pair) - len(self._suffix) -
+                               len(placeholder)]
+        self._first = True
+
+    def encode(self, category):
+        """
+        Function to encode the next category, returning the chunk of the
+        document that carries it.
+        """
+        document = self.dumps({"Category": [category]})
+        element = document[len(self._prefix):len(document) -
+                           len(self._suffix)]
+        if self._first:
+            self._first = False
+            return self._prefix + element
+        return self._separator + element
+
+    def finish(self):
+        """
+        Function to end the document, returning its last chunk.
+        """
+        if self._first:
+            return self.dumps({"Category": []})
+        return self._suffix
+
+
+def streamCatalogJSON(categories, dumps):
+    """
+    Function to encode the catalog export incrementally, one category at a
+    time, see CatalogJSONEncoder.
+
+    Parameters
+    =======================================================
+    categories - iterable of dictionaries
+        The serialized categories as produced by groupCatalogRows.
+    dumps - function
+        Function that encodes a whole document to a string.
+
+    Returns
+    =======================================================
+    generator of strings -
+        The chunks of the encoded document.
+    """
+    encoder = CatalogJSONEncoder(dumps)
+    for category in categories:
+        yield encoder.encode(category)
+    yield encoder.finish()
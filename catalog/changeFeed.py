@@ -0,0 +1,266 @@
+#!/usr/local/bin/python3
+"""
+The changeFeed.py module is a module intended to serve the change log of the
+Catalog Application (see models.CatalogChange) as an incremental feed, so
+that clients mirroring the catalog only fetch what changed since they last
+looked rather than the whole of '/catalog/JSON'. As a standalone module it
+compacts the log.
+
+A client keeps the version of the last change it applied, starting from 0,
+and asks for '/catalog/changes?since=<version>', following the "next" cursor
+of each page with '?after=<next>' until it is null -
+
+    {"Change": [{"version": 7, "type": "item", "op": "update", "id": 3,
+                 "Item": {...}},
+                {"version": 9, "type": "category", "op": "delete", "id": 2}],
+     "version": 9, "next": null}
+
+The "version" of the last page is the one to keep for the next sync.
+Inserts and updates carry the object as it is now and should be applied as
+upserts, a later change to the same object may already show in them. An
+object deleted since is left out of the page, its tombstone follows.
+Reading from 0 gives every object in the catalog.
+
+Compaction drops the entries that a later entry of the same object
+supersedes, so the log grows with the size of the catalog rather than the
+number of writes, and purges tombstones older than
+CATALOG_CHANGES_TOMBSTONE_DAYS. A client that last synced before the purged
+tombstones is answered with a 410 and must sync again from 0, dropping
+whatever it holds that the feed does not return. The "next" cursor carries
+the version the sync started from, so paging through a long sync is never
+mistaken for being behind.
+
+Settings (environment)
+=======================================================
+CATALOG_CHANGES_TOMBSTONE_DAYS - days a tombstone is kept for (default 30)
+
+Usage
+=======================================================
+python3 changeFeed.py              report the size of the change log
+python3 changeFeed.py --compact    compact it, ie from a daily cron job
+"""
+from sqlalchemy import create_engine, and_, exists, func, literal, select
+from models import Item, Category, CatalogChange, CatalogState
+from models import DATABASE_URL
+from pagination import decodeCursor, encodeCursor, pageSize
+from datetime import datetime, timedelta
+
+import argparse
+import os
+import sys
+
+TOMBSTONE_DAYS = int(os.environ.get("CATALOG_CHANGES_TOMBSTONE_DAYS", 30))
+
+# The class and document key of each kind of change
+CHANGE_CLASSES = {
+    "item": (Item, "Item"),
+    "category": (Category, "Category"),
+}
+
+
+class FeedExpired(Exception):
+    """
+    FeedExpired exception raised when the tombstones a client needs have
+    been purged from the change log.
+
+    Attributes
+    =======================================================
+    horizon - int
+        The version up to which tombstones have been purged.
+    """
+
+    def __init__(self, horizon):
+        Exception.__init__(self, "changes purged through {0}".format(horizon))
+        self.horizon = horizon
+
+
+def getChangesHorizon(session):
+    """
+    Function to retrieve the version up to which tombstones have been purged
+    from the change log.
+
+    Parameters
+    =======================================================
+    session - sqlalchemy session
+        The session to issue the query with.
+
+    Returns
+    =======================================================
+    int -
+        The version, 0 if nothing has been purged.
+    """
+    horizon = session.query(CatalogState.changes_horizon).filter_by(
+        id=1).scalar()
+    return horizon or 0
+
+
+def readChanges(session, since=0, after=None, limit=None):
+    """
+    Function to read a page of the change feed, see the module
+    documentation.
+
+    Parameters
+    =======================================================
+    session - sqlalchemy session
+        The session to issue the queries with.
+    since - int
+        The version of the last change the client has applied.
+    after - string
+        The "next" cursor of the previous page, which takes the place of
+        since.
+    limit - int
+        The number of changes to return, see pagination.pageSize.
+
+    Returns
+    =======================================================
+    dictionary -
+        The document to send.
+
+    Raises
+    =======================================================
+    ValueError -
+        If the cursor is malformed.
+    FeedExpired -
+        If tombstones newer than the version the sync started from have been
+        purged.
+    """
+    position = start = since
+    if after is not None:
+        position, start = decodeCursor(after, 2)
+        if not all(isinstance(value, int) and value >= 0
+                   for value in (position, start)):
+            raise ValueError("Malformed cursor {0}".format(after))
+    limit = pageSize(limit)
+    entries = session.query(CatalogChange).filter(
+        CatalogChange.id > position).order_by(CatalogChange.id).limit(
+        limit + 1).all()
+    # checked after reading the entries, so that a purge committed in
+    # between can't take tombstones out of the page unnoticed
+    horizon = getChangesHorizon(session)
+    if 0 < start < horizon:
+        raise FeedExpired(horizon)
+    more = len(entries) > limit
+    entries = entries[:limit]
+    if entries:
+        position = entries[-1].id
+    if not more:
+        # the sync has seen everything, the purged tombstones included
+        position = max(position, horizon)
+
+    objects = {}
+    for kind, (cls, key) in CHANGE_CLASSES.items():
+        objectIds = set(entry.object_id for entry in entries
+                        if entry.kind == kind and entry.op != "delete")
+        if objectIds:
+            objects[kind] = dict(
+                (obj.id, obj) for obj in
+                session.query(cls).filter(cls.id.in_(objectIds)))
+
+    changes = []
+    for entry in entries:
+        change = {"version": entry.id, "type": entry.kind, "op": entry.op,
+                  "id": entry.object_id}
+        if entry.op != "delete":
+            obj = objects[entry.kind].get(entry.object_id)
+            if obj is None:
+                continue
+            change[CHANGE_CLASSES[entry.kind][1]] = obj.serialize
+        changes.append(change)
+    return {"Change": changes, "version": position,
+            "next": encodeCursor([position, start]) if more else None}
+
+
+def seedChanges(connection):
+    """
+    Function to record an insert for every Item and Category in the DB that
+    has no entry in the change log yet, for a catalog that predates it. Safe
+    to run more than once.
+
+    Parameters
+    =======================================================
+    connection - sqlalchemy connection
+        The connection of the transaction to seed the log in.
+
+    Returns
+    =======================================================
+    int -
+        The number of entries recorded.
+    """
+    change = CatalogChange.__table__
+    now = datetime.utcnow()
+    seeded = 0
+    for kind in ("category", "item"):
+        table = CHANGE_CLASSES[kind][0].__table__
+        logged = exists().where(and_(change.c.kind == kind,
+                                     change.c.object_id == table.c.id))
+        seeded += connection.execute(change.insert().from_select(
+            ["kind", "object_id", "op", "changed_at"],
+            select([literal(kind, change.c.kind.type), table.c.id,
+                    literal("insert", change.c.op.type),
+                    literal(now, change.c.changed_at.type)]).where(
+                ~logged).order_by(table.c.id))).rowcount
+    return seeded
+
+
+def compactChanges(connection, tombstoneDays=TOMBSTONE_DAYS):
+    """
+    Function to compact the change log, dropping the entries superseded by
+    a later entry of the same object and purging the older tombstones.
+
+    Parameters
+    =======================================================
+    connection - sqlalchemy connection
+        The connection of the transaction to compact the log in.
+    tombstoneDays - int
+        The number of days tombstones are kept for.
+
+    Returns
+    =======================================================
+    tuple -
+        The number of superseded entries and tombstones removed.
+    """
+    change = CatalogChange.__table__
+    newer = change.alias("newer")
+    superseded = connection.execute(change.delete().where(
+        exists().where(and_(newer.c.kind == change.c.kind,
+                            newer.c.object_id == change.c.object_id,
+                            newer.c.id > change.c.id)))).rowcount
+
+    cutoff = datetime.utcnow() - timedelta(days=tombstoneDays)
+    horizon = connection.execute(select([func.max(change.c.id)]).where(
+        and_(change.c.op == "delete", change.c.changed_at < cutoff))).scalar()
+    if horizon is None:
+        return superseded, 0
+    purged = connection.execute(change.delete().where(
+        and_(change.c.op == "delete", change.c.id <= horizon))).rowcount
+    state = CatalogState.__table__
+    connection.execute(state.update().where(and_(
+        state.c.id == 1, state.c.changes_horizon < horizon)).values(
+        changes_horizon=horizon))
+    return superseded, purged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--compact", action="store_true",
+                        help="drop superseded entries and old tombstones")
+    parser.add_argument("--tombstone-days", type=int, default=TOMBSTONE_DAYS,
+                        help="days a tombstone is kept for")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(DATABASE_URL)
+    change = CatalogChange.__table__
+    with engine.begin() as conn:
+        entries, latest = conn.execute(select([func.count(),
+                                               func.max(change.c.id)])).first()
+        print("{0} entries in the change log, at version {1}".format(
+            entries, latest or 0))
+        if args.compact:
+            print("Dropped {0} superseded entries and purged {1} "
+                  "tombstones".format(*compactChanges(
+                      conn, args.tombstone_days)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
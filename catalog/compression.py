@@ -0,0 +1,379 @@
+#!/usr/local/bin/python3
+"""
+The compression.py module is a module intended to compress the dynamic
+responses of the Catalog Application - the HTML pages and the JSON API - at
+the WSGI level.
+
+The encoding is negotiated from the Accept-Encoding header, brotli when the
+brotli package is installed and the client takes it, gzip otherwise.
+Responses with a known length are compressed in one go once they reach the
+minimum size. Streamed responses (ie the full catalog JSON dump) are
+compressed as they are sent, once enough of them has been seen to pass the
+minimum size. Apps that send their body through the write() callable are
+passed through uncompressed.
+
+A compressed response is sent with its ETag marked with the encoding, as
+Apache's mod_deflate does, and the mark is taken off If-None-Match again
+before the app sees it so that conditional requests still get their 304.
+Compressed bodies of responses that carry an ETag and may be cached are
+kept, so the same representation is only compressed once.
+
+Settings (environment)
+=======================================================
+CATALOG_COMPRESS - 0 to turn compression off (default 1)
+CATALOG_COMPRESS_MIN_SIZE - bytes, smaller responses are sent as is (1024)
+CATALOG_GZIP_LEVEL - 1 to 9 (6)
+CATALOG_BROTLI_QUALITY - 0 to 11 (5)
+CATALOG_COMPRESS_CACHE_BYTES - memory for compressed bodies, 0 for none (16MB)
+"""
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+from caching import MemoryFragmentStore
+
+import os
+import re
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The content types worth compressing, the rest (images, fonts, msgpack)
+# are compressed already or gain too little
+COMPRESSIBLE_TYPES = ("text/html", "text/css", "text/plain", "text/xml",
+                      "application/json", "application/javascript",
+                      "application/xml", "image/svg+xml")
+
+# Statuses that have no body, or a body that must not change
+UNCOMPRESSED_STATUSES = ("204", "206", "304")
+
+ENCODED_ETAG = re.compile(r'-(?:gzip|br)"')
+
+
+def compressionOptions():
+    """
+    Function to build the CompressionMiddleware keyword arguments from the
+    environment, see the module documentation.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    dictionary of keyword arguments for CompressionMiddleware.
+    """
+    return {
+        "minimumSize": int(os.environ.get("CATALOG_COMPRESS_MIN_SIZE", 1024)),
+        "gzipLevel": int(os.environ.get("CATALOG_GZIP_LEVEL", 6)),
+        "brotliQuality": int(os.environ.get("CATALOG_BROTLI_QUALITY", 5)),
+        "cacheBytes": int(os.environ.get("CATALOG_COMPRESS_CACHE_BYTES",
+                                         16 * 1024 * 1024)),
+    }
+
+
+def negotiateEncoding(acceptEncoding, offered=None):
+    """
+    Function to pick the encoding to compress a response with.
+
+    Parameters
+    =======================================================
+    acceptEncoding - string
+        The Accept-Encoding header of the request.
+    offered - list of strings
+        The encodings to choose from, by default brotli (if installed) and
+        gzip.
+
+    Returns
+    =======================================================
+    string -
+        "br" or "gzip", or None if the client takes neither.
+    """
+    if not acceptEncoding:
+        return None
+    if offered is None:
+        offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    accepted = parse_accept_header(acceptEncoding)
+    # the client's preference wins, ties go to the order offered
+    best = None
+    for encoding in offered:
+        quality = accepted[encoding]
+        if quality and (best is None or quality > best[0]):
+            best = (quality, encoding)
+    return best[1] if best is not None else None
+
+
+class Compressor(object):
+    """
+    Compressor class to compress a body incrementally with gzip or brotli.
+
+    Attributes
+    =======================================================
+    encoding - string
+        "gzip" or "br".
+    """
+
+    def __init__(self, encoding, gzipLevel=6, brotliQuality=5):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotliQuality)
+        else:
+            self._zlib = zlib.compressobj(gzipLevel, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """
+        Function to feed more of the body in, returning whatever compressed
+        output is ready (possibly nothing).
+        """
+        if self.encoding == "br":
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def finish(self):
+        """
+        Function to end the body, returning the rest of the compressed output.
+        """
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def compressBody(body, encoding, gzipLevel=6, brotliQuality=5):
+    """
+    Function to compress a whole body.
+
+    Parameters
+    =======================================================
+    body - bytes
+        The body to compress.
+    encoding - string
+        "gzip" or "br".
+    gzipLevel - int
+        The gzip compression level.
+    brotliQuality - int
+        The brotli quality.
+
+    Returns
+    =======================================================
+    bytes -
+        The compressed body.
+    """
+    compressor = Compressor(encoding, gzipLevel, brotliQuality)
+    return compressor.compress(body) + compressor.finish()
+
+
+class CompressionMiddleware(object):
+    """
+    CompressionMiddleware class to compress the responses of a WSGI app,
+    see the module documentation.
+
+    Attributes
+    =======================================================
+    app - WSGI app
+        The app whose responses are compressed.
+    minimumSize - int
+        Responses smaller than this many bytes are sent as they are.
+    gzipLevel - int
+        The gzip compression level.
+    brotliQuality - int
+        The brotli quality.
+    cache - MemoryFragmentStore
+        The compressed bodies of cacheable responses, or None.
+    """
+
+    def __init__(self, app, minimumSize=1024, gzipLevel=6, brotliQuality=5,
+                 cacheBytes=16 * 1024 * 1024):
+        self.app = app
+        self.minimumSize = minimumSize
+        self.gzipLevel = gzipLevel
+        self.brotliQuality = brotliQuality
+        self.cache = MemoryFragmentStore(cacheBytes) if cacheBytes else None
+
+    def __call__(self, environ, start_response):
+        encoding = None
+        if environ.get("REQUEST_METHOD") != "HEAD":
+            encoding = negotiateEncoding(environ.get("HTTP_ACCEPT_ENCODING"))
+        ifNoneMatch = environ.get("HTTP_IF_NONE_MATCH")
+        if ifNoneMatch:
+            environ["HTTP_IF_NONE_MATCH"] = ENCODED_ETAG.sub('"', ifNoneMatch)
+
+        captured = []
+        # the server's write(), once an app writing its body has been passed
+        # through
+        serverWrite = []
+
+        def captureStart(status, headers, exc_info=None):
+            if serverWrite:
+                return start_response(status, headers, exc_info)
+            # nothing is sent before the app returns, so a later call (with
+            # exc_info) simply replaces the response
+            captured[:] = [status, Headers(headers), exc_info]
+            return write
+
+        def write(data):
+            # the body can't be held back from an app that writes it, so it
+            # goes out as it is
+            if not serverWrite:
+                status, headers, exc_info = captured
+                serverWrite.append(start_response(
+                    status, headers.to_wsgi_list(), exc_info))
+            serverWrite[0](data)
+
+        body = self.app(environ, captureStart)
+        if serverWrite:
+            return body
+        status, headers, exc_info = captured
+        if status[:3] == "304" and encoding is not None and ifNoneMatch and \
+                ENCODED_ETAG.search(ifNoneMatch):
+            # confirm the compressed copy the client holds
+            headers = self._encodedHeaders(headers, encoding)
+            del headers["Content-Encoding"]
+        if not self._compressible(status, headers):
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return body
+        self._addVary(headers)
+        if encoding is None:
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return body
+
+        length = headers.get("Content-Length", type=int)
+        if length is not None and length < self.minimumSize:
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return body
+        key = self._cacheKey(environ, headers, encoding)
+        cached = self.cache.get(key) if key is not None else None
+        if cached is not None:
+            # a strong ETag promises the same bytes, so the body need not
+            # even be produced
+            if hasattr(body, "close"):
+                body.close()
+            headers = self._encodedHeaders(headers, encoding)
+            headers["Content-Length"] = str(len(cached))
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return [cached]
+        if length is not None:
+            return self._compressWhole(body, status, headers, exc_info,
+                                       encoding, key, start_response)
+        return self._compressStream(body, status, headers, exc_info,
+                                    encoding, key, start_response)
+
+    @staticmethod
+    def _addVary(headers):
+        vary = headers.get("Vary")
+        if vary is None:
+            headers["Vary"] = "Accept-Encoding"
+            return
+        values = [value.strip().lower() for value in vary.split(",")]
+        if "accept-encoding" not in values and "*" not in values:
+            headers["Vary"] = vary + ", Accept-Encoding"
+
+    @staticmethod
+    def _compressible(status, headers):
+        if status[:3] in UNCOMPRESSED_STATUSES or \
+                "Content-Encoding" in headers:
+            return False
+        if "no-transform" in headers.get("Cache-Control", ""):
+            return False
+        mimetype = headers.get("Content-Type", "").split(";")[0].strip()
+        return mimetype in COMPRESSIBLE_TYPES
+
+    def _cacheKey(self, environ, headers, encoding):
+        # only whole, validated representations are worth keeping
+        etag = headers.get("ETag")
+        cacheControl = headers.get("Cache-Control", "")
+        if self.cache is None or etag is None or etag.startswith("W/") or \
+                "no-store" in cacheControl or "private" in cacheControl:
+            return None
+        return "{0}|{1}?{2}|{3}".format(etag, environ.get("PATH_INFO", ""),
+                                        environ.get("QUERY_STRING", ""),
+                                        encoding)
+
+    def _encodedHeaders(self, headers, encoding):
+        headers["Content-Encoding"] = encoding
+        etag = headers.get("ETag")
+        if etag is not None and etag.endswith('"'):
+            headers["ETag"] = '{0}-{1}"'.format(etag[:-1], encoding)
+        return headers
+
+    def _compressWhole(self, body, status, headers, exc_info, encoding, key,
+                       start_response):
+        try:
+            data = b"".join(body)
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+        compressed = compressBody(data, encoding, self.gzipLevel,
+                                  self.brotliQuality)
+        if key is not None:
+            self.cache.set(key, compressed)
+        headers = self._encodedHeaders(headers, encoding)
+        headers["Content-Length"] = str(len(compressed))
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return [compressed]
+
+    def _compressStream(self, body, status, headers, exc_info, encoding, key,
+                        start_response):
+        iterator = iter(body)
+        # hold the response back until it is known to reach the minimum size
+        pending = []
+        pendingSize = 0
+        finished = False
+        try:
+            while pendingSize < self.minimumSize:
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    finished = True
+                    break
+                pending.append(chunk)
+                pendingSize += len(chunk)
+        except BaseException:
+            if hasattr(body, "close"):
+                body.close()
+            raise
+        if finished and pendingSize < self.minimumSize:
+            if hasattr(body, "close"):
+                body.close()
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return pending
+
+        headers = self._encodedHeaders(headers, encoding)
+        headers.pop("Content-Length", None)
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return self._streamCompressed(body, iterator, pending, finished,
+                                      encoding, key)
+
+    def _streamCompressed(self, body, iterator, pending, finished, encoding,
+                          key):
+        compressor = Compressor(encoding, self.gzipLevel, self.brotliQuality)
+        # kept for the cache until it grows past what the cache would take
+        kept = [] if key is not None else None
+        keptSize = 0
+        try:
+            for chunk in pending:
+                output = compressor.compress(chunk)
+                if output:
+                    if kept is not None:
+                        kept.append(output)
+                        keptSize += len(output)
+                    yield output
+            if not finished:
+                for chunk in iterator:
+                    output = compressor.compress(chunk)
+                    if output:
+                        if kept is not None:
+                            kept.append(output)
+                            keptSize += len(output)
+                            if keptSize > self.cache.maxBytes:
+                                kept = None
+                        yield output
+            output = compressor.finish()
+            if kept is not None:
+                kept.append(output)
+                self.cache.set(key, b"".join(kept))
+            yield output
+        finally:
+            if hasattr(body, "close"):
+                body.close()
@@ -0,0 +1,179 @@
+#!/usr/local/bin/python3
+"""
+The httpCaching.py module is a module intended to add HTTP validation caching
+(ETag/Last-Modified with 304 responses) and Cache-Control policies to the
+routes of the Catalog Application.
+
+A route opts in with the conditional decorator, giving it a function that
+cheaply stamps the current state of the resource. When the client already
+holds that state the view itself is never run, so no serialization work is
+done to answer the poll.
+
+Last-Modified only has a resolution of one second, so it is left out (and
+If-Modified-Since not honoured) while the resource was changed within the
+current second - a later change in that same second would otherwise be
+answered with a stale 304. The ETag covers those responses.
+"""
+from flask import current_app, request
+from functools import wraps
+from werkzeug.http import is_resource_modified
+from serializers import negotiatedMimetype
+from models import Item, getCatalogState
+from datetime import datetime
+
+import hashlib
+
+# Cache-Control sent by a conditional route with no entry in the
+# CACHE_CONTROL app config. Caches may store the response but must check
+# back with the ETag before reusing it.
+DEFAULT_CACHE_CONTROL = "no-cache"
+
+
+def cacheControlFor(endpoint):
+    """
+    Function to look up the Cache-Control policy of an endpoint. Policies are
+    set per endpoint name in the CACHE_CONTROL dictionary of the app config.
+
+    Parameters
+    =======================================================
+    endpoint - string
+        The name of the endpoint (the view function name).
+
+    Returns
+    =======================================================
+    string -
+        The Cache-Control header value.
+    """
+    policies = current_app.config.get("CACHE_CONTROL", {})
+    return policies.get(endpoint, DEFAULT_CACHE_CONTROL)
+
+
+def stampCatalog(session):
+    """
+    Function to stamp the current state of the catalog as a whole.
+
+    Parameters
+    =======================================================
+    session - sqlalchemy session
+        The session to issue the query with.
+
+    Returns
+    =======================================================
+    tuple -
+        The catalog version and the time it last changed.
+    """
+    version, updated = getCatalogState(session)
+    return "catalog-{0}".format(version), updated
+
+
+def stampItem(session, itemId):
+    """
+    Function to stamp the current state of a single item.
+
+    Parameters
+    =======================================================
+    session - sqlalchemy session
+        The session to issue the query with.
+    itemId - int
+        The id of the item in the DB.
+
+    Returns
+    =======================================================
+    tuple -
+        The item stamp and the time it last changed, or None if the item does
+        not exist.
+    """
+    item = session.query(Item.updated_at).filter_by(id=itemId).first()
+    if item is None:
+        return None
+    return "item-{0}-{1}".format(itemId, item.updated_at), item.updated_at
+
+
+def makeETag(stamp, variant=""):
+    """
+    Function to build a strong ETag for a resource state and the particular
+    representation asked for.
+
+    Parameters
+    =======================================================
+    stamp - string
+        A string that changes whenever the resource changes.
+    variant - string
+        Anything else that changes the bytes sent, ie the query string.
+
+    Returns
+    =======================================================
+    string -
+        The unquoted ETag.
+    """
+    digest = hashlib.sha1("{0}|{1}".format(stamp, variant).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def settledLastModified(lastModified, now=None):
+    """
+    Function to check that a Last-Modified time can be used as a validator,
+    ie that the second it falls in is over, see the module documentation.
+
+    Parameters
+    =======================================================
+    lastModified - datetime or None
+        The time the resource last changed, in UTC.
+    now - datetime
+        The current time in UTC, by default the time of the call.
+
+    Returns
+    =======================================================
+    datetime or None -
+        lastModified, or None if it is not safe to use.
+    """
+    if lastModified is None:
+        return None
+    if now is None:
+        now = datetime.utcnow()
+    if lastModified.replace(microsecond=0) >= now.replace(microsecond=0):
+        return None
+    return lastModified
+
+
+def conditional(stampFunc):
+    """
+    Decorator to make a view answer conditional GETs.
+
+    Parameters
+    =======================================================
+    stampFunc - function
+        Called with the view arguments, returns a (stamp, lastModified) tuple
+        describing the current state of the resource, or None if the state
+        can't be told (the view then runs as normal).
+
+    Returns
+    =======================================================
+    The decorated view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            state = stampFunc(*args, **kwargs)
+            if state is None:
+                return view(*args, **kwargs)
+            stamp, lastModified = state
+            lastModified = settledLastModified(lastModified)
+            # the same URL can be sent as JSON or MessagePack
+            etag = makeETag(stamp, "{0}|{1}".format(
+                request.full_path, negotiatedMimetype()))
+            cacheControl = cacheControlFor(request.endpoint)
+
+            if not is_resource_modified(request.environ, etag=etag,
+                                        last_modified=lastModified):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            if lastModified is not None:
+                response.last_modified = lastModified
+            response.headers["Cache-Control"] = cacheControl
+            response.vary.add("Accept")
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,160 @@
+#!/usr/local/bin/python3
+"""
+The instrumentation.py module is a module intended to measure where the time
+goes in each request handled by the Catalog Application.
+
+For every request it records the wall time of the route, the number and
+total time of the SQL statements run (through the engine's cursor events)
+and the time spent rendering templates. Requests that go over the configured
+thresholds are written to the slow request log along with their statements,
+and while debugging the numbers are sent back in a Server-Timing header.
+
+Settings (app.config)
+=======================================================
+SLOW_REQUEST_MS - float
+    Requests taking longer than this are logged as slow (default 500).
+SLOW_REQUEST_QUERIES - int
+    Requests issuing more statements than this are logged as slow (50).
+SERVER_TIMING - bool
+    Send the Server-Timing header, on by default when app.debug is set.
+"""
+from flask import g, has_request_context, request, signals
+from sqlalchemy import event
+
+import logging
+import time
+
+# The slow request log, see catalogApp.py for where it is written to
+slowLog = logging.getLogger("catalog.slow")
+
+# At most this many statements are kept per request for the slow log
+MAX_STATEMENTS = 100
+
+
+def _stats():
+    """
+    Function to fetch the timings of the current request, if any.
+    """
+    if has_request_context():
+        return g.get("requestStats")
+    return None
+
+
+def _beforeCursorExecute(conn, cursor, statement, parameters, context,
+                         executemany):
+    conn.info.setdefault("queryStart", []).append(time.perf_counter())
+
+
+def _afterCursorExecute(conn, cursor, statement, parameters, context,
+                        executemany):
+    elapsed = time.perf_counter() - conn.info["queryStart"].pop()
+    stats = _stats()
+    if stats is None:
+        return
+    stats["sqlCount"] += 1
+    stats["sqlTime"] += elapsed
+    if len(stats["statements"]) < MAX_STATEMENTS:
+        stats["statements"].append((elapsed, statement))
+
+
+def _handleError(context):
+    # after_cursor_execute is skipped for a failed statement
+    starts = context.connection.info.get("queryStart") \
+        if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def _beforeRender(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None:
+        stats["renderStart"] = time.perf_counter()
+
+
+def _afterRender(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None and stats.get("renderStart") is not None:
+        stats["renderTime"] += time.perf_counter() - stats["renderStart"]
+        stats["renderStart"] = None
+
+
+def _startRequest():
+    g.requestStats = {
+        "start": time.perf_counter(),
+        "sqlCount": 0,
+        "sqlTime": 0.0,
+        "statements": [],
+        "renderTime": 0.0,
+        "renderStart": None,
+    }
+
+
+def _finishRequest(app, response):
+    stats = _stats()
+    if stats is None:
+        return response
+    total = time.perf_counter() - stats["start"]
+
+    if total * 1000 > app.config.get("SLOW_REQUEST_MS", 500) or \
+            stats["sqlCount"] > app.config.get("SLOW_REQUEST_QUERIES", 50):
+        lines = ["%.1fms %s" % (elapsed * 1000, " ".join(statement.split()))
+                 for elapsed, statement in stats["statements"]]
+        slowLog.warning(
+            "Slow request %s %s (%s) total=%.1fms sql=%d/%.1fms "
+            "render=%.1fms\n    %s",
+            request.method, request.full_path, request.endpoint,
+            total * 1000, stats["sqlCount"], stats["sqlTime"] * 1000,
+            stats["renderTime"] * 1000, "\n    ".join(lines))
+
+    if app.config.get("SERVER_TIMING", app.debug):
+        response.headers["Server-Timing"] = ", ".join((
+            "app;dur=%.2f" % (total * 1000),
+            "sql;desc=\"%d statements\";dur=%.2f" % (
+                stats["sqlCount"], stats["sqlTime"] * 1000),
+            "render;dur=%.2f" % (stats["renderTime"] * 1000),
+        ))
+    return response
+
+
+def instrumentEngine(engine):
+    """
+    Function to time the statements run through an engine, for engines the
+    app uses besides the one given to instrumentApp (ie read replicas).
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy engine
+        The engine to time the statements of.
+
+    Returns
+    =======================================================
+    None
+    """
+    event.listen(engine, "before_cursor_execute", _beforeCursorExecute)
+    event.listen(engine, "after_cursor_execute", _afterCursorExecute)
+    event.listen(engine, "handle_error", _handleError)
+
+
+def instrumentApp(app, engine):
+    """
+    Function to hook the request timings into an app and its engine.
+
+    Parameters
+    =======================================================
+    app - Flask
+        The flask app to time the requests of.
+    engine - sqlalchemy engine
+        The engine the app runs its statements through.
+
+    Returns
+    =======================================================
+    None
+    """
+    instrumentEngine(engine)
+    # Template timings need blinker, without it they are reported as 0
+    if getattr(signals, "signals_available", True):
+        signals.before_render_template.connect(_beforeRender, app,
+                                               weak=False)
+        signals.template_rendered.connect(_afterRender, app, weak=False)
+    app.before_request(_startRequest)
+    app.after_request(lambda response: _finishRequest(app, response))
@@ -0,0 +1,113 @@
+#!/usr/local/bin/python3
+"""
+The itemCounts.py module is a standalone module intended to check the item
+counts kept on each category of the Catalog Application against the items
+actually in the DB, and to repair any that have drifted.
+
+The counts are kept up to date on every write (see models.trackItemCounts and
+models.adjustItemCounts), so drift means something wrote to the Item table
+behind the application's back - a manual fix in psql, say.
+
+Usage
+=======================================================
+python3 itemCounts.py            report the categories that are off
+python3 itemCounts.py --repair   and set them to the counted values
+"""
+from sqlalchemy import create_engine, func, select
+from models import Item, Category, DATABASE_URL, bumpCatalogVersion
+from models import recordChanges
+
+import argparse
+import sys
+
+
+def findDrift(connection):
+    """
+    Function to find the categories whose item count does not match the
+    number of items under them, in a single grouped query.
+
+    Parameters
+    =======================================================
+    connection - sqlalchemy connection
+        The connection to issue the query with.
+
+    Returns
+    =======================================================
+    list of tuples -
+        The (id, name, item_count, actual count) of each category that is
+        off.
+    """
+    category = Category.__table__
+    item = Item.__table__
+    actual = func.count(item.c.id)
+    return connection.execute(
+        select([category.c.id, category.c.name, category.c.item_count,
+                actual]).select_from(category.outerjoin(
+                    item, item.c.category_id == category.c.id)).group_by(
+            category.c.id, category.c.name, category.c.item_count).having(
+            category.c.item_count != actual).order_by(category.c.id)).fetchall()
+
+
+def repairItemCounts(connection, categoryIds=None):
+    """
+    Function to set the item counts to the number of items under each
+    category, bumping the catalog version and recording the updates in the
+    change log if any of them changed.
+
+    Parameters
+    =======================================================
+    connection - sqlalchemy connection
+        The connection of the transaction to repair the counts in.
+    categoryIds - list of int
+        Only repair these categories, by default all of them.
+
+    Returns
+    =======================================================
+    int -
+        The number of categories that were changed.
+    """
+    drifted = [row[0] for row in findDrift(connection)]
+    if categoryIds is not None:
+        categoryIds = set(categoryIds)
+        drifted = [categoryId for categoryId in drifted
+                   if categoryId in categoryIds]
+    if not drifted:
+        return 0
+    category = Category.__table__
+    item = Item.__table__
+    actual = select([func.count(item.c.id)]).where(
+        item.c.category_id == category.c.id).scalar_subquery()
+    repaired = connection.execute(
+        category.update().values(item_count=actual).where(
+            category.c.id.in_(drifted))).rowcount
+    bumpCatalogVersion(connection)
+    recordChanges(connection, [("category", categoryId, "update")
+                               for categoryId in drifted])
+    return repaired
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repair", action="store_true",
+                        help="set the drifted counts to the counted values")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(DATABASE_URL)
+    with engine.begin() as conn:
+        drift = findDrift(conn)
+        for categoryId, name, itemCount, actual in drift:
+            print("{0} {1!r} has item_count {2} but {3} items".format(
+                categoryId, name, itemCount, actual))
+        if not drift:
+            print("Item counts are consistent")
+            return 0
+        if not args.repair:
+            return 1
+        print("Repaired {0} categories".format(repairItemCounts(
+            conn, [categoryId for categoryId, name, itemCount, actual
+                   in drift])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+#!/usr/local/bin/python3
+"""
+The logConfig.py module is a module intended to set up logging for the
+Catalog Application.
+
+Request threads only ever put records on a queue, a background thread takes
+them off and does the actual (slow) writing to the log files and console, so
+logging never holds up a request on disk or terminal I/O. The log files are
+rotated so they can't grow without bound.
+
+Settings (environment)
+=======================================================
+CATALOG_LOG_LEVEL - the level to log at (default INFO)
+CATALOG_LOG_MAX_BYTES - size to rotate the log files at (default 10MB)
+CATALOG_LOG_BACKUPS - the number of rotated files to keep (default 5)
+CATALOG_LOG_WHEN - rotate on time instead of size, ie 'midnight' or 'H'
+CATALOG_LOG_CONSOLE - also log to the console, 0 or 1 (default 1)
+"""
+from logging.handlers import QueueHandler, QueueListener
+from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+
+import atexit
+import logging
+import os
+import queue
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+
+def rotatingHandler(path):
+    """
+    Function to create a file handler for path that rotates as configured.
+
+    Parameters
+    =======================================================
+    path - string
+        The log file to write.
+
+    Returns
+    =======================================================
+    logging.Handler -
+        The rotating file handler.
+    """
+    backups = int(os.environ.get("CATALOG_LOG_BACKUPS", 5))
+    when = os.environ.get("CATALOG_LOG_WHEN")
+    if when:
+        return TimedRotatingFileHandler(path, when=when,
+                                        backupCount=backups, delay=True)
+    maxBytes = int(os.environ.get("CATALOG_LOG_MAX_BYTES", 10 * 1024 * 1024))
+    return RotatingFileHandler(path, maxBytes=maxBytes, backupCount=backups,
+                               delay=True)
+
+
+def configureLogging(logDir="logs"):
+    """
+    Function to send all logging through a queue to a background writer.
+
+    Everything goes to debug.log (and the console), records from the
+    catalog.slow logger also go to slow.log.
+
+    Parameters
+    =======================================================
+    logDir - string
+        The directory to write the log files to, created if it is missing.
+
+    Returns
+    =======================================================
+    QueueListener -
+        The running background writer, it is stopped (flushing anything
+        still queued) when the interpreter exits.
+    """
+    # a fresh checkout or deploy has no log directory yet
+    os.makedirs(logDir, exist_ok=True)
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [rotatingHandler(os.path.join(logDir, "debug.log"))]
+    if os.environ.get("CATALOG_LOG_CONSOLE", "1") == "1":
+        handlers.append(logging.StreamHandler())
+    slowHandler = rotatingHandler(os.path.join(logDir, "slow.log"))
+    slowHandler.addFilter(logging.Filter("catalog.slow"))
+    handlers.append(slowHandler)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.Queue(-1)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(records))
+    root.setLevel(os.environ.get("CATALOG_LOG_LEVEL", "INFO").upper())
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stopLogging, listener)
+    return listener
+
+
+def stopLogging(listener):
+    """
+    Function to stop a background writer started by configureLogging once
+    everything queued so far has been written. Stopping it twice is harmless.
+
+    Parameters
+    =======================================================
+    listener - QueueListener
+        The background writer to stop.
+
+    Returns
+    =======================================================
+    None
+    """
+    if listener._thread is not None:
+        listener.stop()
@@ -0,0 +1,235 @@
+#!/usr/local/bin/python3
+"""
+The migrate.py module is a standalone module intended to create the
+Catalog Application DB, or bring an existing one up to date with the object
+model in models.py. The app itself never changes the schema, so run this
+before starting it for the first time and after every upgrade.
+
+Base.metadata.create_all only creates tables that do not exist yet, so any
+change made to an existing table has to be applied here. Every migration is
+safe to run more than once.
+
+Usage
+=======================================================
+python3 migrate.py
+"""
+from sqlalchemy import create_engine, func, inspect
+from sqlalchemy.orm import sessionmaker
+from models import Base, Item, Category, User, CatalogState, DATABASE_URL
+from models import seedCatalogState
+from search import createSearchIndex
+from itemCounts import repairItemCounts
+from changeFeed import seedChanges
+from datetime import datetime
+
+import sys
+
+
+def findDuplicates(session, column):
+    """
+    Function to find the values of a column that appear more than once.
+
+    Parameters
+    =======================================================
+    session - sqlalchemy session
+        The session to issue the query with.
+    column - mapped attribute
+        The column to check.
+
+    Returns
+    =======================================================
+    list of tuples -
+        The duplicated values along with the number of rows holding each.
+    """
+    return session.query(column, func.count()).group_by(column).having(
+        func.count() > 1).all()
+
+
+def createSchema(engine):
+    """
+    Migration that creates the tables of the object model that do not exist
+    yet, ie everything on a new DB, and the CatalogState row if it is missing.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy engine
+        The engine for the DB to migrate.
+
+    Returns
+    =======================================================
+    bool -
+        True if the migration was applied.
+    """
+    Base.metadata.create_all(engine)
+    # the row comes with the table, but not on a DB whose table is older
+    with engine.begin() as conn:
+        seedCatalogState(conn)
+    return True
+
+
+def addLookupIndexes(engine):
+    """
+    Migration that adds the lookup indexes and unique constraints on
+    Item.name, Category.name, Item.category_id and User.email.
+
+    The unique indexes cannot be created while duplicates exist, so those are
+    reported rather than removed - which row to keep is left to the admin.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy engine
+        The engine for the DB to migrate.
+
+    Returns
+    =======================================================
+    bool -
+        True if the migration was applied.
+    """
+    session = sessionmaker(bind=engine)()
+    duplicates = False
+    for column in (Item.name, Category.name, User.email):
+        for value, count in findDuplicates(session, column):
+            print("{0} {1!r} appears {2} times".format(column, value, count))
+            duplicates = True
+    session.close()
+    if duplicates:
+        print("Resolve the duplicates above and rerun the migration")
+        return False
+
+    for table in (User.__table__, Category.__table__, Item.__table__):
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    return True
+
+
+def addUpdatedAt(engine):
+    """
+    Migration that adds the updated_at modification stamp to the Item and
+    Category tables, stamping every existing row with the current time.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy engine
+        The engine for the DB to migrate.
+
+    Returns
+    =======================================================
+    bool -
+        True if the migration was applied.
+    """
+    now = datetime.utcnow()
+    for table in (Item.__table__, Category.__table__):
+        columns = [column["name"] for column in
+                   inspect(engine).get_columns(table.name)]
+        if "updated_at" in columns:
+            continue
+        columnType = table.c.updated_at.type.compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.execute('ALTER TABLE "{0}" ADD COLUMN updated_at {1}'.format(
+                table.name, columnType))
+            conn.execute(table.update().values(updated_at=now))
+    return True
+
+
+def addSearchIndex(engine):
+    """
+    Migration that adds the full-text search index over the item names and
+    descriptions (see search.py), indexing the items already in the DB.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy engine
+        The engine for the DB to migrate.
+
+    Returns
+    =======================================================
+    bool -
+        True if the migration was applied.
+    """
+    createSearchIndex(engine).install(engine)
+    return True
+
+
+def addItemCounts(engine):
+    """
+    Migration that adds the item_count column to the Category table and
+    counts the items already under each category.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy engine
+        The engine for the DB to migrate.
+
+    Returns
+    =======================================================
+    bool -
+        True if the migration was applied.
+    """
+    table = Category.__table__
+    columns = [column["name"] for column in
+               inspect(engine).get_columns(table.name)]
+    with engine.begin() as conn:
+        if "item_count" not in columns:
+            conn.execute('ALTER TABLE "{0}" ADD COLUMN item_count {1} '
+                         'DEFAULT 0 NOT NULL'.format(
+                             table.name, table.c.item_count.type.compile(
+                                 dialect=engine.dialect)))
+        repairItemCounts(conn)
+    return True
+
+
+def addChangeLog(engine):
+    """
+    Migration that adds the changes_horizon column to the CatalogState table
+    if it is missing and records an insert in the change log (see
+    changeFeed.py) for every item and category that has no entry in it yet.
+    The CatalogChange table itself is created by createSchema, which on a DB
+    that predates the log also creates CatalogState with the column, so the
+    seeding can't hang off the column being added.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy engine
+        The engine for the DB to migrate.
+
+    Returns
+    =======================================================
+    bool -
+        True if the migration was applied.
+    """
+    table = CatalogState.__table__
+    columns = [column["name"] for column in
+               inspect(engine).get_columns(table.name)]
+    with engine.begin() as conn:
+        if "changes_horizon" not in columns:
+            conn.execute('ALTER TABLE "{0}" ADD COLUMN changes_horizon {1} '
+                         'DEFAULT 0 NOT NULL'.format(
+                             table.name, table.c.changes_horizon.type.compile(
+                                 dialect=engine.dialect)))
+        print("Recorded {0} changes".format(seedChanges(conn)))
+    return True
+
+
+# Applied in order, each one must be safe to rerun
+MIGRATIONS = (
+    createSchema,
+    addLookupIndexes,
+    addUpdatedAt,
+    addSearchIndex,
+    addItemCounts,
+    addChangeLog,
+)
+
+
+def main():
+    engine = create_engine(DATABASE_URL)
+    for migration in MIGRATIONS:
+        print("Applying {0}".format(migration.__name__))
+        if not migration(engine):
+            return 1
+    print("DB migrated")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
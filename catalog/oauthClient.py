@@ -0,0 +1,246 @@
+#!/usr/local/bin/python3
+"""
+The oauthClient.py module is a module intended to handle all the outbound
+HTTP calls the Catalog Application makes to the Google and Facebook OAuth
+providers.
+
+All calls go through one shared requests session, so connections to each
+provider are pooled and kept alive between logins. Every call has strict
+connect/read timeouts so that a slow provider can't hold on to a mod_wsgi
+thread, and idempotent calls are retried with backoff on connection errors
+and 5xx responses. The client secrets files are read once, and token info
+lookups are cached briefly.
+
+The provider URLs can be pointed at a local stub server through the
+environment -
+
+CATALOG_GOOGLE_API_URL - default https://www.googleapis.com
+CATALOG_GOOGLE_ACCOUNTS_URL - default https://accounts.google.com
+CATALOG_FACEBOOK_GRAPH_URL - default https://graph.facebook.com
+CATALOG_OAUTH_CONNECT_TIMEOUT - seconds, default 3
+CATALOG_OAUTH_READ_TIMEOUT - seconds, default 10
+CATALOG_OAUTH_RETRIES - default 2
+"""
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import json
+import logging
+import os
+import requests
+import threading
+import time
+
+GOOGLE_API_URL = os.environ.get("CATALOG_GOOGLE_API_URL",
+                                "https://www.googleapis.com")
+GOOGLE_ACCOUNTS_URL = os.environ.get("CATALOG_GOOGLE_ACCOUNTS_URL",
+                                     "https://accounts.google.com")
+FACEBOOK_GRAPH_URL = os.environ.get("CATALOG_FACEBOOK_GRAPH_URL",
+                                    "https://graph.facebook.com")
+
+TIMEOUT = (float(os.environ.get("CATALOG_OAUTH_CONNECT_TIMEOUT", 3)),
+           float(os.environ.get("CATALOG_OAUTH_READ_TIMEOUT", 10)))
+RETRIES = int(os.environ.get("CATALOG_OAUTH_RETRIES", 2))
+
+# Seconds a successful token info lookup is reused for
+TOKEN_INFO_TTL = 60
+
+# urllib3 logs the full URL of every retry, and the Facebook token exchange
+# carries the app secret in its query string
+logging.getLogger("urllib3.connectionpool").setLevel(logging.ERROR)
+
+# Raised for any failure to talk to a provider - connection errors,
+# timeouts and retries running out
+ProviderError = requests.RequestException
+
+_secrets = {}
+_secretsLock = threading.Lock()
+_tokenInfo = {}
+_tokenInfoLock = threading.Lock()
+
+
+def _createSession():
+    retryArgs = {"total": RETRIES, "backoff_factor": 0.3,
+                 "status_forcelist": (500, 502, 503, 504)}
+    methods = frozenset(("GET", "DELETE"))
+    try:
+        retry = Retry(allowed_methods=methods, **retryArgs)
+    except TypeError:
+        # urllib3 before 1.26
+        retry = Retry(method_whitelist=methods, **retryArgs)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# requests sessions are safe to share between threads for plain requests
+http = _createSession()
+
+
+def clientSecrets(path):
+    """
+    Function to retrieve the "web" section of a client secrets file, reading
+    the file only the first time it is asked for.
+
+    Parameters
+    =======================================================
+    path - string
+        The path of the client secrets file.
+
+    Returns
+    =======================================================
+    dictionary of the client secrets.
+    """
+    with _secretsLock:
+        if path not in _secrets:
+            with open(path, "r") as secretsFile:
+                _secrets[path] = json.load(secretsFile)["web"]
+        return _secrets[path]
+
+
+def getJSON(url, params=None):
+    """
+    Function to GET a provider URL and decode the JSON answer.
+
+    Parameters
+    =======================================================
+    url - string
+        The URL to fetch.
+    params - dictionary
+        The query string arguments.
+
+    Returns
+    =======================================================
+    The decoded JSON body.
+
+    Raises
+    =======================================================
+    ProviderError -
+        If the provider could not be reached in time.
+    """
+    response = http.get(url, params=params, timeout=TIMEOUT)
+    return response.json()
+
+
+def request(method, url, params=None):
+    """
+    Function to send a request to a provider URL.
+
+    Parameters
+    =======================================================
+    method - string
+        The HTTP method.
+    url - string
+        The URL to request.
+    params - dictionary
+        The query string arguments.
+
+    Returns
+    =======================================================
+    requests.Response -
+        The provider's response.
+
+    Raises
+    =======================================================
+    ProviderError -
+        If the provider could not be reached in time.
+    """
+    return http.request(method, url, params=params, timeout=TIMEOUT)
+
+
+def googleFlow(secretsPath):
+    """
+    Function to build the flow used to upgrade a Google authorization code,
+    from the cached client secrets.
+
+    Parameters
+    =======================================================
+    secretsPath - string
+        The path of the Google client secrets file.
+
+    Returns
+    =======================================================
+    OAuth2WebServerFlow -
+        The flow, with the postmessage redirect set.
+    """
+    # oauth2client is slow to import and only needed to log in, so it is
+    # left out of the start up of the app
+    from oauth2client.client import OAuth2WebServerFlow
+    secrets = clientSecrets(secretsPath)
+    accounts = os.environ.get("CATALOG_GOOGLE_ACCOUNTS_URL")
+    tokenUri = secrets["token_uri"] if accounts is None else \
+        accounts + "/o/oauth2/token"
+    return OAuth2WebServerFlow(client_id=secrets["client_id"],
+                               client_secret=secrets["client_secret"],
+                               scope="", redirect_uri="postmessage",
+                               auth_uri=secrets["auth_uri"],
+                               token_uri=tokenUri)
+
+
+def exchangeGoogleCode(secretsPath, code):
+    """
+    Function to upgrade a Google authorization code into credentials.
+
+    Parameters
+    =======================================================
+    secretsPath - string
+        The path of the Google client secrets file.
+    code - bytes or string
+        The authorization code.
+
+    Returns
+    =======================================================
+    OAuth2Credentials -
+        The upgraded credentials.
+
+    Raises
+    =======================================================
+    FlowExchangeError -
+        If the code could not be upgraded.
+    """
+    import httplib2
+    # oauth2client talks httplib2, which is not thread safe so each exchange
+    # gets its own, but with the same read timeout as everything else
+    return googleFlow(secretsPath).step2_exchange(
+        code, http=httplib2.Http(timeout=TIMEOUT[1]))
+
+
+def googleTokenInfo(accessToken):
+    """
+    Function to look up the details of a Google access token. Successful
+    lookups are cached for TOKEN_INFO_TTL seconds.
+
+    Parameters
+    =======================================================
+    accessToken - string
+        The access token to look up.
+
+    Returns
+    =======================================================
+    dictionary of the token details, holding an "error" entry if Google
+    rejected the token.
+
+    Raises
+    =======================================================
+    ProviderError -
+        If Google could not be reached in time.
+    """
+    now = time.monotonic()
+    with _tokenInfoLock:
+        cached = _tokenInfo.get(accessToken)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        # drop anything expired so the cache can't grow without bound
+        for token in [token for token, entry in _tokenInfo.items()
+                      if entry[0] <= now]:
+            del _tokenInfo[token]
+
+    result = getJSON(GOOGLE_API_URL + "/oauth2/v1/tokeninfo",
+                     params={"access_token": accessToken})
+    if result.get("error") is None:
+        with _tokenInfoLock:
+            _tokenInfo[accessToken] = (now + TOKEN_INFO_TTL, result)
+    return result
@@ -0,0 +1,159 @@
+#!/usr/local/bin/python3
+"""
+The pagination.py module is a module intended to provide keyset (cursor)
+based paging for the listings of the Catalog Application.
+
+Rather than skipping over rows with OFFSET, which gets slower the deeper a
+client pages, each page is fetched by seeking past the sort key of the last
+row already seen. The sort key always ends in the primary key so that it is
+unique and no row is ever skipped or repeated.
+"""
+from collections import namedtuple
+from sqlalchemy import tuple_
+
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+Page = namedtuple("Page", ["items", "next", "prev", "limit"])
+
+
+def pageSize(limit):
+    """
+    Function to clamp a requested page size to the allowed range.
+
+    Parameters
+    =======================================================
+    limit - int or None
+        The page size asked for by the client.
+
+    Returns
+    =======================================================
+    int -
+        DEFAULT_PAGE_SIZE if no size was asked for, otherwise the size
+        bounded to 1..MAX_PAGE_SIZE.
+    """
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def encodeCursor(values):
+    """
+    Function to encode a sort key into an opaque cursor for a URL.
+
+    Parameters
+    =======================================================
+    values - list
+        The sort key values of a row.
+
+    Returns
+    =======================================================
+    string -
+        The URL safe cursor.
+    """
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decodeCursor(cursor, size, types=None):
+    """
+    Function to decode a cursor created by encodeCursor.
+
+    Parameters
+    =======================================================
+    cursor - string
+        The cursor passed in by the client.
+    size - int
+        The number of values the sort key is expected to have.
+    types - list of types
+        The python type of each value, None values are always allowed. By
+        default any string, number or None is.
+
+    Returns
+    =======================================================
+    list -
+        The sort key values.
+
+    Raises
+    =======================================================
+    ValueError -
+        If the cursor is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Malformed cursor {0}".format(cursor))
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Malformed cursor {0}".format(cursor))
+    for value, valueType in zip(values, types or [None] * size):
+        if value is None:
+            continue
+        if valueType is float:
+            valueType = (int, float)
+        # a bool is an int to isinstance but never a sort key
+        if isinstance(value, bool) or not isinstance(
+                value, valueType or (str, int, float)):
+            raise ValueError("Malformed cursor {0}".format(cursor))
+    return values
+
+
+def keysetPage(query, columns, after=None, before=None, limit=None):
+    """
+    Function to fetch one page of a query using keyset pagination.
+
+    Parameters
+    =======================================================
+    query - sqlalchemy Query
+        The query to page through. It must not already be ordered.
+    columns - list of mapped attributes
+        The columns that make up the sort key, the last one being unique.
+    after - string
+        Cursor of the row to start after when paging forward.
+    before - string
+        Cursor of the row to end before when paging backward.
+    limit - int
+        The page size asked for by the client.
+
+    Returns
+    =======================================================
+    Page -
+        The rows of the page along with the cursors for the next and
+        previous pages (None where there is no such page).
+
+    Raises
+    =======================================================
+    ValueError -
+        If either cursor is malformed.
+    """
+    limit = pageSize(limit)
+    key = tuple_(*columns)
+    types = [column.type.python_type for column in columns]
+
+    if before is not None:
+        values = decodeCursor(before, len(columns), types)
+        rows = query.filter(key < tuple_(*values)).order_by(
+            *[column.desc() for column in columns]).limit(limit + 1).all()
+        hasPrev = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        hasNext = True
+    else:
+        query = query.order_by(*columns)
+        if after is not None:
+            values = decodeCursor(after, len(columns), types)
+            query = query.filter(key > tuple_(*values))
+        rows = query.limit(limit + 1).all()
+        hasNext = len(rows) > limit
+        rows = rows[:limit]
+        hasPrev = after is not None
+
+    def cursorFor(row):
+        return encodeCursor([getattr(row, column.key) for column in columns])
+
+    nextCursor = cursorFor(rows[-1]) if rows and hasNext else None
+    prevCursor = cursorFor(rows[0]) if rows and hasPrev else None
+    return Page(rows, nextCursor, prevCursor, limit)
@@ -0,0 +1,196 @@
+#!/usr/local/bin/python3
+"""
+The replicas.py module is a module intended to spread the read traffic of the
+Catalog Application over one or more read replicas of the catalog database.
+
+Sessions made by a RoutingSession factory send everything to the primary
+unless they have been marked read only, in which case their queries go to
+one of the replicas, picked round-robin. Writes (flushes) always go to the
+primary. A replica that fails is taken out of the rotation until a
+background check finds it healthy again, and when no replica is healthy the
+primary serves the reads.
+
+The replicas are listed in CATALOG_REPLICA_URLS (see models.py). Locally they
+can be copies of a SQLite file, or a second Postgres instance.
+"""
+from sqlalchemy import create_engine, event, exc, select
+from sqlalchemy.orm import Session
+from models import CatalogState
+
+import logging
+import threading
+import time
+
+# Seconds between the background health checks of the replicas
+CHECK_INTERVAL = 10
+
+
+class ReplicaSet(object):
+    """
+    ReplicaSet class to hold the replica engines and track which of them are
+    healthy.
+
+    Attributes
+    =======================================================
+    engines - list of sqlalchemy engines
+        The replica engines, in rotation order.
+    checkInterval - float
+        Seconds between the background health checks.
+    """
+
+    def __init__(self, urls, checkInterval=CHECK_INTERVAL, **options):
+        self.engines = [create_engine(url, **options) for url in urls]
+        self.checkInterval = checkInterval
+        self._lock = threading.Lock()
+        self._next = 0
+        self._down = set()
+        self._watcher = None
+        for engine in self.engines:
+            event.listen(engine, "handle_error", self._onError)
+
+    def __len__(self):
+        return len(self.engines)
+
+    def _onError(self, context):
+        # connection failures and missing tables both mean the replica
+        # can't serve reads right now
+        if context.is_disconnect or isinstance(
+                context.sqlalchemy_exception, exc.OperationalError):
+            self.markDown(context.engine)
+
+    def markDown(self, engine):
+        """
+        Function to take a replica out of the rotation until the next health
+        check finds it working.
+
+        Parameters
+        =======================================================
+        engine - sqlalchemy engine
+            The failed replica.
+
+        Returns
+        =======================================================
+        None
+        """
+        with self._lock:
+            if engine not in self._down:
+                logging.warning("Replica %s is down", engine.url)
+                self._down.add(engine)
+
+    def choose(self):
+        """
+        Function to pick the replica to serve the next read only session.
+
+        Parameters
+        =======================================================
+        None
+
+        Returns
+        =======================================================
+        sqlalchemy engine -
+            The next healthy replica, or None if there is none.
+        """
+        self._startWatching()
+        with self._lock:
+            for attempt in range(len(self.engines)):
+                engine = self.engines[self._next]
+                self._next = (self._next + 1) % len(self.engines)
+                if engine not in self._down:
+                    return engine
+        return None
+
+    def check(self):
+        """
+        Function to check every replica can answer a query on the catalog,
+        putting the ones that recovered back into the rotation.
+
+        Parameters
+        =======================================================
+        None
+
+        Returns
+        =======================================================
+        list of bools -
+            Whether each replica is healthy, in rotation order.
+        """
+        healthy = []
+        for engine in self.engines:
+            try:
+                with engine.connect() as conn:
+                    conn.execute(select([CatalogState.version]).limit(1))
+            except exc.SQLAlchemyError:
+                # the handle_error hook has taken it out of the rotation
+                healthy.append(False)
+                continue
+            with self._lock:
+                if engine in self._down:
+                    logging.info("Replica %s is back up", engine.url)
+                    self._down.discard(engine)
+            healthy.append(True)
+        return healthy
+
+    def _startWatching(self):
+        # started on first use rather than at import, so that it runs in
+        # each mod_wsgi process rather than only in the parent
+        if self._watcher is not None:
+            return
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch,
+                                                 name="replica-check")
+                self._watcher.daemon = True
+                self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.checkInterval)
+            try:
+                self.check()
+            except Exception:
+                logging.exception("Replica health check failed")
+
+
+class RoutingSession(Session):
+    """
+    RoutingSession class to send the queries of read only sessions to a
+    replica and everything else to the primary.
+
+    A session is marked read only by setting info["readOnly"]. It sticks to
+    the replica it first picks so that all its reads see the same state, and
+    falls back to the primary when none of the replicas can be reached.
+
+    Attributes
+    =======================================================
+    replicas - ReplicaSet
+        The replicas to read from, given to the sessionmaker.
+    """
+
+    def __init__(self, replicas=None, **kwargs):
+        self.replicas = replicas
+        super(RoutingSession, self).__init__(**kwargs)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        primary = super(RoutingSession, self).get_bind(mapper, clause,
+                                                       **kwargs)
+        if self._flushing or not self.replicas or \
+                not self.info.get("readOnly"):
+            return primary
+        replica = self.info.get("replica")
+        if replica is None:
+            replica = self._connectReplica() or primary
+            self.info["replica"] = replica
+        return replica
+
+    def _connectReplica(self):
+        # the connection is opened here rather than on first use, so that a
+        # replica that can't be reached is skipped instead of failing the
+        # request
+        while True:
+            replica = self.replicas.choose()
+            if replica is None:
+                return None
+            try:
+                self.connection(bind=replica)
+                return replica
+            except exc.DBAPIError:
+                self.replicas.markDown(replica)
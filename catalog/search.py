@@ -0,0 +1,499 @@
+#!/usr/local/bin/python3
+"""
+The search.py module is a module intended to provide ranked full-text search
+over the names and descriptions of the items in the Catalog Application.
+
+Searching is backed by an index suited to the DB in use -
+
+PostgresSearch - a stored, generated tsvector column with a GIN index.
+SqliteSearch - an FTS5 table kept up to date by triggers on the Item table.
+MemorySearch - an in-process inverted index for any other DB, or SQLite
+    builds without FTS5.
+
+The two DB backed indexes are maintained by the DB itself, so every write
+path (the routes, bulkLoad.py, manual SQL) keeps them in sync. The in-process
+index follows the commits made through the app's sessions and rebuilds
+itself when it notices that another process has changed the catalog.
+
+Item names weigh more than descriptions when ranking. Every word of the
+query must match. Every match is ranked, however many there are, and only
+the best are kept as they are ranked so the memory a search takes is bounded
+by its limit.
+
+Settings (environment)
+=======================================================
+CATALOG_SEARCH_BACKEND - force a backend, "postgres", "sqlite" or "memory"
+CATALOG_SEARCH_REBUILD - seconds between rebuilds of the in-process index
+    when other processes change the catalog (default 30)
+"""
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import joinedload
+from models import Item, Category, CatalogState
+
+import collections
+import heapq
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Words are runs of letters and digits, compared in lower case
+WORD = re.compile(r"\w+", re.UNICODE)
+
+# How much more a word in the item name counts than one in the description
+NAME_WEIGHT = 4
+
+
+def searchTerms(query):
+    """
+    Function to split a search query into the words to look for.
+
+    Parameters
+    =======================================================
+    query - string
+        The search text entered by the user.
+
+    Returns
+    =======================================================
+    list of strings -
+        The lower case words of the query, without duplicates, in the order
+        they were entered.
+    """
+    terms = []
+    for term in WORD.findall((query or "").lower()):
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+
+class PostgresSearch(object):
+    """
+    PostgresSearch class to search items through a weighted tsvector column
+    that PostgreSQL generates from the name and description of each item,
+    indexed with GIN. Needs PostgreSQL 12 or later.
+    """
+    name = "postgres"
+
+    def install(self, engine):
+        """
+        Function to add the search column and its index to the Item table if
+        they are missing. Adding the column rewrites the table, so on a large
+        existing catalog run migrate.py rather than letting the app do it.
+
+        Parameters
+        =======================================================
+        engine - sqlalchemy engine
+            The engine for the DB to search.
+
+        Returns
+        =======================================================
+        None
+        """
+        columns = [column["name"] for column in
+                   inspect(engine).get_columns(Item.__tablename__)]
+        with engine.begin() as conn:
+            if "search_vector" not in columns:
+                conn.execute(text(
+                    'ALTER TABLE "Item" ADD COLUMN search_vector tsvector '
+                    "GENERATED ALWAYS AS ("
+                    "setweight(to_tsvector('english', name), 'A') || "
+                    "setweight(to_tsvector('english', "
+                    "coalesce(description, '')), 'B')) STORED"))
+            conn.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_item_search_vector '
+                'ON "Item" USING gin (search_vector)'))
+
+    def track(self, sessionFactory):
+        # The generated column is kept up to date by PostgreSQL itself
+        pass
+
+    def search(self, session, query, limit):
+        """
+        Function to find the items best matching a query.
+
+        Parameters
+        =======================================================
+        session - sqlalchemy session
+            The session to issue the query with.
+        query - string
+            The search text entered by the user.
+        limit - int
+            The most item ids to return.
+
+        Returns
+        =======================================================
+        list of ints -
+            The ids of the matching items, best match first.
+        """
+        if not searchTerms(query):
+            return []
+        rows = session.execute(text(
+            "SELECT id FROM \"Item\" "
+            "WHERE search_vector @@ plainto_tsquery('english', :query) "
+            "ORDER BY ts_rank(search_vector, "
+            "plainto_tsquery('english', :query)) DESC, id LIMIT :limit"),
+            {"query": query, "limit": limit})
+        return [row[0] for row in rows]
+
+
+class SqliteSearch(object):
+    """
+    SqliteSearch class to search items through an FTS5 table that mirrors
+    the name and description columns of the Item table. Triggers on the Item
+    table keep the FTS5 table in step with every insert, update and delete.
+    """
+    name = "sqlite"
+
+    DDL = (
+        'CREATE VIRTUAL TABLE IF NOT EXISTS "ItemSearch" USING fts5('
+        "name, description, content='Item', content_rowid='id', "
+        "tokenize='porter unicode61')",
+        'CREATE TRIGGER IF NOT EXISTS item_search_insert AFTER INSERT ON '
+        '"Item" BEGIN INSERT INTO "ItemSearch"(rowid, name, description) '
+        "VALUES (new.id, new.name, new.description); END",
+        'CREATE TRIGGER IF NOT EXISTS item_search_delete AFTER DELETE ON '
+        '"Item" BEGIN INSERT INTO "ItemSearch"("ItemSearch", rowid, name, '
+        "description) VALUES ('delete', old.id, old.name, old.description); "
+        "END",
+        'CREATE TRIGGER IF NOT EXISTS item_search_update AFTER UPDATE OF '
+        'name, description ON "Item" BEGIN INSERT INTO "ItemSearch"('
+        '"ItemSearch", rowid, name, description) VALUES (\'delete\', '
+        "old.id, old.name, old.description); INSERT INTO \"ItemSearch\"("
+        "rowid, name, description) VALUES (new.id, new.name, "
+        "new.description); END",
+    )
+
+    @staticmethod
+    def available():
+        """
+        Function to check whether the sqlite library was built with FTS5.
+        """
+        try:
+            conn = sqlite3.connect(":memory:")
+            conn.execute("CREATE VIRTUAL TABLE probe USING fts5(body)")
+            conn.close()
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def install(self, engine):
+        """
+        Function to create the FTS5 table and its triggers if they are
+        missing, indexing the items already in the DB.
+
+        Parameters
+        =======================================================
+        engine - sqlalchemy engine
+            The engine for the DB to search.
+
+        Returns
+        =======================================================
+        None
+        """
+        with engine.begin() as conn:
+            # the triggers go when the Item table is dropped, in which case
+            # whatever is left in the FTS5 table is stale
+            tracked = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND "
+                "name = 'item_search_insert'")).first() is not None
+            for statement in self.DDL:
+                conn.execute(text(statement))
+            if not tracked:
+                conn.execute(text(
+                    'INSERT INTO "ItemSearch"("ItemSearch") '
+                    "VALUES ('rebuild')"))
+
+    def track(self, sessionFactory):
+        # The triggers keep the FTS5 table up to date
+        pass
+
+    def search(self, session, query, limit):
+        """
+        Function to find the items best matching a query.
+
+        Parameters
+        =======================================================
+        session - sqlalchemy session
+            The session to issue the query with.
+        query - string
+            The search text entered by the user.
+        limit - int
+            The most item ids to return.
+
+        Returns
+        =======================================================
+        list of ints -
+            The ids of the matching items, best match first.
+        """
+        terms = searchTerms(query)
+        if not terms:
+            return []
+        # quote every word so nothing the user types is read as FTS5 syntax
+        match = " ".join('"{0}"'.format(term) for term in terms)
+        rows = session.execute(text(
+            'SELECT rowid FROM "ItemSearch" WHERE "ItemSearch" MATCH :match '
+            'ORDER BY bm25("ItemSearch", :nameWeight, 1.0), rowid '
+            "LIMIT :limit"),
+            {"match": match, "nameWeight": float(NAME_WEIGHT),
+             "limit": limit})
+        return [row[0] for row in rows]
+
+
+class MemorySearch(object):
+    """
+    MemorySearch class to search items through an inverted index held in the
+    process.
+
+    The index is built from the DB on the first search. Commits made through
+    the tracked sessions are applied to it as they happen, and the catalog
+    version (see models.CatalogState) tells it when anything else changed
+    the catalog, in which case it is rebuilt - at most once every
+    rebuildInterval seconds.
+
+    Attributes
+    =======================================================
+    rebuildInterval - float
+        The least number of seconds between two rebuilds.
+    version - int or None
+        The catalog version the index is up to date with, None before the
+        first build.
+    """
+    name = "memory"
+
+    def __init__(self, rebuildInterval=30):
+        self.rebuildInterval = rebuildInterval
+        self.version = None
+        self._lock = threading.Lock()
+        self._builtAt = 0.0
+        self._postings = {}
+        self._documents = {}
+
+    def install(self, engine):
+        # Nothing is stored in the DB
+        pass
+
+    @staticmethod
+    def _weights(name, description):
+        weights = collections.Counter()
+        for term in WORD.findall((name or "").lower()):
+            weights[term] += NAME_WEIGHT
+        for term in WORD.findall((description or "").lower()):
+            weights[term] += 1
+        return weights
+
+    def _remove(self, itemId):
+        for term in self._documents.pop(itemId, ()):
+            postings = self._postings[term]
+            del postings[itemId]
+            if not postings:
+                del self._postings[term]
+
+    def _add(self, itemId, name, description):
+        weights = self._weights(name, description)
+        self._documents[itemId] = tuple(weights)
+        for term, weight in weights.items():
+            self._postings.setdefault(term, {})[itemId] = weight
+
+    def rebuild(self, session):
+        """
+        Function to index every item in the DB from scratch.
+
+        Parameters
+        =======================================================
+        session - sqlalchemy session
+            The session to read the items with.
+
+        Returns
+        =======================================================
+        None
+        """
+        # read the version first, so a write made during the read shows up
+        # as a newer version and is picked up by the next rebuild
+        version = session.execute(select([CatalogState.version]).where(
+            CatalogState.id == 1)).scalar() or 0
+        fresh = MemorySearch()
+        for itemId, name, description in session.query(
+                Item.id, Item.name, Item.description).yield_per(10000):
+            fresh._add(itemId, name, description)
+        with self._lock:
+            self._postings = fresh._postings
+            self._documents = fresh._documents
+            self.version = version
+            self._builtAt = time.monotonic()
+
+    def _refresh(self, session):
+        version = session.execute(select([CatalogState.version]).where(
+            CatalogState.id == 1)).scalar() or 0
+        with self._lock:
+            if self.version is not None and (
+                    version == self.version or
+                    time.monotonic() - self._builtAt < self.rebuildInterval):
+                return
+        self.rebuild(session)
+
+    def track(self, sessionFactory):
+        """
+        Function to keep the index in step with the commits made through the
+        sessions of a session factory.
+
+        Parameters
+        =======================================================
+        sessionFactory - sessionmaker
+            The factory of the sessions the app writes through.
+
+        Returns
+        =======================================================
+        None
+        """
+        event.listen(sessionFactory, "after_flush", self._afterFlush)
+        event.listen(sessionFactory, "after_commit", self._afterCommit)
+        event.listen(sessionFactory, "after_rollback", self._afterRollback)
+
+    def _afterFlush(self, session, flush_context):
+        changes = session.info.setdefault("searchChanges", {})
+        touched = False
+        for obj in session.new:
+            if isinstance(obj, Item):
+                changes[obj.id] = (obj.name, obj.description)
+            touched = touched or isinstance(obj, (Item, Category))
+        for obj in session.dirty:
+            if isinstance(obj, Item) and session.is_modified(obj):
+                changes[obj.id] = (obj.name, obj.description)
+            touched = touched or isinstance(obj, (Item, Category))
+        for obj in session.deleted:
+            if isinstance(obj, Item):
+                changes[obj.id] = None
+            touched = touched or isinstance(obj, (Item, Category))
+        if touched:
+            # models.trackCatalogChanges bumped the version for this flush
+            session.info.setdefault("searchVersions", []).append(
+                session.connection().execute(
+                    select([CatalogState.version]).where(
+                        CatalogState.id == 1)).scalar())
+
+    def _afterCommit(self, session):
+        changes = session.info.pop("searchChanges", {})
+        versions = session.info.pop("searchVersions", [])
+        with self._lock:
+            if self.version is None:
+                return
+            for itemId, values in changes.items():
+                self._remove(itemId)
+                if values is not None:
+                    self._add(itemId, *values)
+            # the bumps of one transaction follow each other, anything
+            # before them that this index hasn't seen came from elsewhere
+            if versions and versions[0] == self.version + 1:
+                self.version = versions[-1]
+
+    def _afterRollback(self, session):
+        session.info.pop("searchChanges", None)
+        session.info.pop("searchVersions", None)
+
+    def search(self, session, query, limit):
+        """
+        Function to find the items best matching a query.
+
+        Parameters
+        =======================================================
+        session - sqlalchemy session
+            The session to (re)build the index with when it is out of date.
+        query - string
+            The search text entered by the user.
+        limit - int
+            The most item ids to return.
+
+        Returns
+        =======================================================
+        list of ints -
+            The ids of the matching items, best match first.
+        """
+        terms = searchTerms(query)
+        if not terms:
+            return []
+        self._refresh(session)
+        with self._lock:
+            postings = [self._postings.get(term) for term in terms]
+            if not all(postings):
+                return []
+            total = len(self._documents)
+            postings.sort(key=len)
+            idfs = [math.log(1 + total / float(len(termPostings)))
+                    for termPostings in postings]
+            # walk the rarest word's items, every other word must also
+            # match, keeping only the best limit of them as they are scored
+            best = heapq.nsmallest(limit, self._scores(postings, idfs),
+                                   key=lambda entry: (-entry[1], entry[0]))
+        return [itemId for itemId, score in best]
+
+    @staticmethod
+    def _scores(postings, idfs):
+        for itemId in postings[0]:
+            score = 0.0
+            for termPostings, idf in zip(postings, idfs):
+                weight = termPostings.get(itemId)
+                if weight is None:
+                    break
+                score += weight * idf
+            else:
+                yield itemId, score
+
+
+def createSearchIndex(engine):
+    """
+    Function to pick the search backend for the DB behind an engine.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy engine
+        The engine for the DB to search.
+
+    Returns
+    =======================================================
+    PostgresSearch, SqliteSearch or MemorySearch -
+        The backend, CATALOG_SEARCH_BACKEND overrides the choice.
+    """
+    backend = os.environ.get("CATALOG_SEARCH_BACKEND")
+    if backend is None:
+        if engine.dialect.name == "postgresql":
+            backend = "postgres"
+        elif engine.dialect.name == "sqlite" and SqliteSearch.available():
+            backend = "sqlite"
+        else:
+            backend = "memory"
+    if backend == "postgres":
+        return PostgresSearch()
+    if backend == "sqlite":
+        return SqliteSearch()
+    return MemorySearch(
+        float(os.environ.get("CATALOG_SEARCH_REBUILD", 30)))
+
+
+def searchItems(index, session, query, limit):
+    """
+    Function to run a search and load the matching items.
+
+    Parameters
+    =======================================================
+    index - PostgresSearch, SqliteSearch or MemorySearch
+        The search backend.
+    session - sqlalchemy session
+        The session to load the items with.
+    query - string
+        The search text entered by the user.
+    limit - int
+        The most items to return.
+
+    Returns
+    =======================================================
+    list of Items -
+        The matching items along with their categories, best match first.
+    """
+    itemIds = index.search(session, query, limit)
+    if not itemIds:
+        return []
+    items = dict((item.id, item) for item in session.query(Item).options(
+        joinedload(Item.category)).filter(Item.id.in_(itemIds)))
+    return [items[itemId] for itemId in itemIds if itemId in items]
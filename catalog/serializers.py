@@ -0,0 +1,216 @@
+#!/usr/local/bin/python3
+"""
+The serializers.py module is a module intended to encode the responses of the
+JSON API of the Catalog Application.
+
+JSON is encoded with the fastest encoder installed - orjson, then ujson,
+falling back to the standard library - always with sorted keys, and compact
+unless the JSON_COMPACT app config is turned off. Clients that send
+'Accept: application/msgpack' get MessagePack instead when the msgpack
+package is installed.
+
+Settings (environment)
+=======================================================
+CATALOG_JSON_ENCODER - force an encoder, "orjson", "ujson" or "json"
+"""
+from flask import current_app, request
+
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+# Also seen in the wild for MessagePack
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, "application/x-msgpack")
+
+
+def _stdlibDumps(obj, compact):
+    if compact:
+        return json.dumps(obj, separators=(",", ":"), sort_keys=True).\
+            encode("utf-8")
+    return json.dumps(obj, indent=2, sort_keys=True).encode("utf-8")
+
+
+def _ujsonDumps(obj, compact):
+    return ujson.dumps(obj, sort_keys=True, ensure_ascii=False,
+                       indent=0 if compact else 2).encode("utf-8")
+
+
+def _orjsonDumps(obj, compact):
+    option = orjson.OPT_SORT_KEYS
+    if not compact:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, option=option)
+
+
+# The JSON encoders in order of preference, each one takes the object and
+# the compact flag and returns UTF-8 bytes
+ENCODERS = [("json", _stdlibDumps)]
+if ujson is not None:
+    ENCODERS.insert(0, ("ujson", _ujsonDumps))
+if orjson is not None:
+    ENCODERS.insert(0, ("orjson", _orjsonDumps))
+
+
+def jsonEncoder(name=None):
+    """
+    Function to pick the JSON encoder to use.
+
+    Parameters
+    =======================================================
+    name - string
+        The encoder asked for, by default CATALOG_JSON_ENCODER or else the
+        fastest one installed.
+
+    Returns
+    =======================================================
+    tuple -
+        The (name, dumps) of the encoder.
+    """
+    name = name or os.environ.get("CATALOG_JSON_ENCODER")
+    for encoder in ENCODERS:
+        if encoder[0] == name:
+            return encoder
+    return ENCODERS[0]
+
+
+encoderName, _dumps = jsonEncoder()
+
+
+def dumpsJSON(obj, compact=True):
+    """
+    Function to encode an object as JSON with the chosen encoder.
+
+    Parameters
+    =======================================================
+    obj - dictionary
+        The object to encode.
+    compact - bool
+        Leave out all optional whitespace, otherwise indent by 2.
+
+    Returns
+    =======================================================
+    bytes -
+        The UTF-8 encoded JSON document.
+    """
+    return _dumps(obj, compact)
+
+
+def dumpsMsgpack(obj):
+    """
+    Function to encode an object as MessagePack.
+
+    Parameters
+    =======================================================
+    obj - dictionary
+        The object to encode.
+
+    Returns
+    =======================================================
+    bytes -
+        The MessagePack document.
+    """
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def negotiateMimetype(accept):
+    """
+    Function to pick the format of a response from the Accept header of its
+    request. JSON is the default, MessagePack is only offered when the
+    msgpack package is installed.
+
+    Parameters
+    =======================================================
+    accept - MIMEAccept
+        The parsed Accept header.
+
+    Returns
+    =======================================================
+    string -
+        Either JSON_MIMETYPE or MSGPACK_MIMETYPE.
+    """
+    offered = [JSON_MIMETYPE]
+    if msgpack is not None:
+        offered.extend(MSGPACK_MIMETYPES)
+    best = accept.best_match(offered, JSON_MIMETYPE)
+    return MSGPACK_MIMETYPE if best in MSGPACK_MIMETYPES else JSON_MIMETYPE
+
+
+def negotiatedMimetype():
+    """
+    Function to pick the format of the response to the current request, see
+    negotiateMimetype.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    string -
+        Either JSON_MIMETYPE or MSGPACK_MIMETYPE.
+    """
+    return negotiateMimetype(request.accept_mimetypes)
+
+
+def jsonText(obj):
+    """
+    Function to encode an object exactly as encodeResponse would for a JSON
+    response, but as text (see catalogExport.streamCatalogJSON).
+
+    Parameters
+    =======================================================
+    obj - dictionary
+        The object to encode.
+
+    Returns
+    =======================================================
+    string -
+        The JSON document.
+    """
+    return dumpsJSON(obj, current_app.config.get("JSON_COMPACT", True)).\
+        decode("utf-8")
+
+
+def encodeResponse(obj, status=200):
+    """
+    Function to build the response for an API object in the format the
+    client asked for.
+
+    Parameters
+    =======================================================
+    obj - dictionary
+        The object to send.
+    status - int
+        The HTTP status of the response.
+
+    Returns
+    =======================================================
+    Response -
+        The encoded response, with a Vary header as its format depends on
+        the Accept header.
+    """
+    mimetype = negotiatedMimetype()
+    if mimetype == MSGPACK_MIMETYPE:
+        body = dumpsMsgpack(obj)
+    else:
+        body = dumpsJSON(obj, current_app.config.get("JSON_COMPACT", True))
+    response = current_app.response_class(body, status=status,
+                                          mimetype=mimetype)
+    response.vary.add("Accept")
+    return response
@@ -0,0 +1,58 @@
+"""
+Shared setup of the tests: the catalog modules are imported from the catalog
+directory, against a scratch DB that must be chosen before models.py reads
+CATALOG_DATABASE_URL.
+"""
+import os
+import sys
+import tempfile
+
+CATALOG_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "catalog")
+SCRATCH_DIR = tempfile.mkdtemp(prefix="catalog-tests-")
+
+sys.path.insert(0, CATALOG_DIR)
+os.environ["CATALOG_DATABASE_URL"] = "sqlite:///{0}".format(
+    os.path.join(SCRATCH_DIR, "catalog.db"))
+# benchmark.py points CATALOG_DATABASE_URL at its own DB when imported
+os.environ["CATALOG_BENCH_DATABASE_URL"] = os.environ["CATALOG_DATABASE_URL"]
+os.environ["CATALOG_LOG_DIR"] = os.path.join(SCRATCH_DIR, "logs")
+os.environ["CATALOG_LOG_CONSOLE"] = "0"
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def app():
+    """
+    The app under test. The caches and DB session of catalogApp are shared
+    by the whole process, so every test shares the one app.
+    """
+    from benchmark import benchApp
+    from models import Base, DATABASE_URL
+    from sqlalchemy import create_engine
+
+    # the search index is installed against the schema
+    engine = create_engine(DATABASE_URL)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return benchApp()
+
+
+@pytest.fixture(scope="session")
+def seed(app):
+    """
+    Function to wipe the scratch DB and fill it with a synthetic catalog,
+    taking the arguments of benchmark.seedCatalog after the engine.
+    """
+    from benchmark import seedCatalog
+    import catalogApp
+
+    def seedApp(categories, itemsPerCategory, **options):
+        catalogApp.session.remove()
+        seedCatalog(catalogApp.engine, categories, itemsPerCategory,
+                    **options)
+        # the search triggers went with the Item table
+        catalogApp.searchIndex.install(catalogApp.engine)
+        catalogApp.invalidateCaches()
+    return seedApp
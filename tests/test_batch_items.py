@@ -0,0 +1,106 @@
+"""
+Tests of the batch endpoint, /catalog/items/batch (see batchItems.py): each
+operation gets the status it would have got on its own, and only a batch
+that conflicts with another change is refused as a whole.
+"""
+import pytest
+
+from benchmark import loginClient
+from models import Item, Category
+
+import batchItems
+import catalogApp
+
+
+@pytest.fixture
+def client(app, seed):
+    # one item per category, owned in turn by users 1 and 2
+    seed(4, 1, users=2)
+    client = app.test_client()
+    loginClient(client, userId=1)
+    return client
+
+
+def post(client, operations):
+    return client.post("/catalog/items/batch",
+                       json={"operations": operations})
+
+
+def names(model):
+    catalogApp.session.remove()
+    return set(name for name, in catalogApp.session.query(model.name))
+
+
+def test_each_operation_gets_its_own_status(client):
+    response = post(client, [
+        {"op": "create", "name": "zebra", "category": "stripes",
+         "description": "stripey"},
+        {"op": "update", "id": 3, "description": "edited",
+         "category": "category000002"},
+        {"op": "delete", "id": 1},
+        {"op": "update", "id": 2, "description": "not mine"},
+        {"op": "create", "name": "item000003-000",
+         "category": "category000003"},
+        {"op": "update", "id": 999, "description": "gone"},
+        {"op": "update", "description": "no id"},
+        {"op": "create", "name": "bad", "category": "stripes",
+         "description": 5},
+        {"op": ["unhashable"]},
+        {"op": "rename"},
+    ])
+    assert response.status_code == 200
+    statuses = [outcome["status"]
+                for outcome in response.get_json()["results"]]
+    assert statuses == [201, 200, 200, 403, 409, 404, 400, 400, 400, 400]
+
+    catalogApp.session.remove()
+    assert "zebra" in names(Item)
+    assert "bad" not in names(Item)
+    assert catalogApp.session.query(Item).get(3).description == "edited"
+    assert catalogApp.session.query(Item).get(2).description != "not mine"
+
+
+def test_emptied_categories_are_removed(client):
+    response = post(client, [
+        {"op": "delete", "id": 1},
+        {"op": "update", "id": 3, "description": "moved",
+         "category": "fresh"},
+    ])
+    assert [outcome["status"] for outcome in
+            response.get_json()["results"]] == [200, 200]
+    categories = names(Category)
+    assert "category000000" not in categories
+    assert "category000002" not in categories
+    assert "fresh" in categories
+
+
+def test_conflicting_batch_is_refused_as_a_whole(client, monkeypatch):
+    load = batchItems.ItemBatch._load
+
+    def loadThenConflict(self, operations):
+        load(self, operations)
+        # another process takes the name once the batch has checked it
+        with catalogApp.engine.begin() as conn:
+            conn.execute(Item.__table__.insert(), {
+                "name": "zebra", "description": "first", "category_id": 2,
+                "user_id": 2})
+    monkeypatch.setattr(batchItems.ItemBatch, "_load", loadThenConflict)
+
+    response = post(client, [
+        {"op": "delete", "id": 1},
+        {"op": "create", "name": "zebra", "category": "stripes"},
+    ])
+    assert response.status_code == 409
+    assert "item000000-000" in names(Item)
+    assert "stripes" not in names(Category)
+
+
+def test_malformed_body_is_a_400(client):
+    response = client.post("/catalog/items/batch", json={"operations": 1})
+    assert response.status_code == 400
+
+
+def test_batch_needs_a_login(app, seed):
+    seed(1, 1)
+    response = post(app.test_client(), [{"op": "delete", "id": 1}])
+    assert response.status_code == 401
@@ -0,0 +1,75 @@
+"""
+Tests that the streamed catalog export (see catalogExport.CatalogJSONEncoder)
+is byte for byte the document dumps produces for the whole export, which is
+what lets '/catalog/JSON?stream=1' stand in for '/catalog/JSON'.
+"""
+import json
+
+import pytest
+
+from catalogExport import streamCatalogJSON
+from models import Item, Category
+
+import catalogApp
+
+CATEGORIES = [
+    {"id": 1, "name": "café", "Item": [
+        {"cat_id": 1, "description": None, "id": 1, "title": "a \"b\""},
+        {"cat_id": 1, "description": "", "id": 2, "title": "☃"}]},
+    {"id": 2, "name": "empty"},
+    {"id": 3, "name": "line\nbreak", "Item": [
+        {"cat_id": 3, "description": "x" * 100, "id": 3, "title": "c"}]},
+]
+
+DUMPS = [
+    json.dumps,
+    lambda obj: json.dumps(obj, separators=(",", ":")),
+    lambda obj: json.dumps(obj, indent=2, sort_keys=True),
+    lambda obj: json.dumps(obj, ensure_ascii=False, indent="\t"),
+]
+
+
+@pytest.mark.parametrize("dumps", DUMPS)
+@pytest.mark.parametrize("count", [0, 1, len(CATEGORIES)])
+def test_stream_matches_dumps(dumps, count):
+    categories = CATEGORIES[:count]
+    streamed = "".join(streamCatalogJSON(iter(categories), dumps))
+    assert streamed == dumps({"Category": categories})
+
+
+@pytest.fixture(params=[True, False], ids=["compact", "indented"])
+def client(request, app):
+    compact = app.config.get("JSON_COMPACT", True)
+    app.config["JSON_COMPACT"] = request.param
+    yield app.test_client()
+    app.config["JSON_COMPACT"] = compact
+
+
+def bodies(client):
+    catalogApp.invalidateCaches()
+    whole = client.get("/catalog/JSON")
+    streamed = client.get("/catalog/JSON?stream=1")
+    assert whole.status_code == streamed.status_code == 200
+    return whole.get_data(), streamed.get_data()
+
+
+def test_streamed_response_matches_the_whole_one(client, seed):
+    seed(5, 3)
+    with catalogApp.engine.begin() as conn:
+        conn.execute(Item.__table__.update().where(
+            Item.__table__.c.id == 1).values(description="café \"☃\""))
+        conn.execute(Item.__table__.update().where(
+            Item.__table__.c.id == 2).values(description=None))
+    whole, streamed = bodies(client)
+    assert streamed == whole
+    assert len(json.loads(whole)["Category"]) == 5
+
+
+def test_streamed_response_matches_for_an_empty_catalog(client, seed):
+    seed(1, 1)
+    with catalogApp.engine.begin() as conn:
+        conn.execute(Item.__table__.delete())
+        conn.execute(Category.__table__.delete())
+    whole, streamed = bodies(client)
+    assert streamed == whole
+    assert json.loads(whole) == {"Category": []}
@@ -0,0 +1,143 @@
+"""
+Tests of the change feed served at /catalog/changes (see changeFeed.py): a
+client mirroring the catalog through it must end up with what /catalog/JSON
+holds, across compaction, and be told with a 410 once the tombstones it
+needs have been purged.
+"""
+import pytest
+
+from benchmark import loginClient
+from changeFeed import compactChanges
+from models import CatalogChange
+
+import catalogApp
+
+DOCUMENT_KEYS = {"item": "Item", "category": "Category"}
+
+
+@pytest.fixture
+def client(app, seed):
+    seed(3, 2)
+    client = app.test_client()
+    loginClient(client)
+    return client
+
+
+def sync(client, mirror, since=0, limit=2):
+    """
+    Apply the feed from a version on to a mirror, page by page, returning
+    the version to sync from next.
+    """
+    url = "/catalog/changes?since={0}&limit={1}".format(since, limit)
+    while True:
+        response = client.get(url)
+        assert response.status_code == 200
+        document = response.get_json()
+        for change in document["Change"]:
+            objects = mirror.setdefault(change["type"], {})
+            if change["op"] == "delete":
+                objects.pop(change["id"], None)
+            else:
+                objects[change["id"]] = change[DOCUMENT_KEYS[change["type"]]]
+        if document["next"] is None:
+            return document["version"]
+        url = "/catalog/changes?after={0}&limit={1}".format(
+            document["next"], limit)
+
+
+def catalogMirror(client):
+    """
+    The mirror a client should hold, read from the full catalog dump.
+    """
+    categories = {}
+    items = {}
+    for category in client.get("/catalog/JSON").get_json()["Category"]:
+        for item in category.pop("Item", []):
+            items[item["id"]] = item
+        categories[category["id"]] = category
+    return {"category": categories, "item": items}
+
+
+def compact(tombstoneDays=30):
+    catalogApp.session.remove()
+    with catalogApp.engine.begin() as conn:
+        return compactChanges(conn, tombstoneDays)
+
+
+def writeSome(client):
+    client.post("/catalog/item/new/", data={
+        "name": "zebra", "category": "stripes", "description": "stripey"})
+    client.post("/catalog/item/1/edit", data={
+        "category": "stripes", "description": "moved"})
+    # the last item of the first category, which goes with it
+    client.post("/catalog/item/2/delete")
+
+
+def test_sync_from_zero_mirrors_the_catalog(client):
+    mirror = {}
+    version = sync(client, mirror)
+    assert version > 0
+    assert mirror == catalogMirror(client)
+
+
+def test_sync_since_applies_inserts_updates_and_deletes(client):
+    mirror = {}
+    version = sync(client, mirror)
+    writeSome(client)
+
+    response = client.get("/catalog/changes?since={0}&limit=200".format(
+        version))
+    changes = [(change["type"], change["op"], change["id"])
+               for change in response.get_json()["Change"]]
+    assert ("item", "update", 1) in changes
+    assert ("item", "delete", 2) in changes
+    assert ("category", "delete", 1) in changes
+    assert any(change[:2] == ("item", "insert") for change in changes)
+
+    assert sync(client, mirror, version) > version
+    assert mirror == catalogMirror(client)
+    assert mirror["item"][1]["description"] == "moved"
+
+
+def test_compaction_keeps_the_latest_entry_of_each_object(client):
+    writeSome(client)
+    client.post("/catalog/item/1/edit", data={
+        "category": "stripes", "description": "moved again"})
+    superseded, purged = compact()
+    assert superseded > 0
+    assert purged == 0
+
+    entries = catalogApp.session.query(
+        CatalogChange.kind, CatalogChange.object_id).all()
+    assert len(entries) == len(set(entries))
+    mirror = {}
+    sync(client, mirror)
+    assert mirror == catalogMirror(client)
+    assert compact() == (0, 0)
+
+
+def test_sync_behind_purged_tombstones_is_refused(client):
+    mirror = {}
+    version = sync(client, mirror)
+    writeSome(client)
+    # purge every tombstone, however recent
+    superseded, purged = compact(tombstoneDays=-1)
+    assert purged > 0
+
+    response = client.get("/catalog/changes?since={0}".format(version))
+    assert response.status_code == 410
+    horizon = response.get_json()["version"]
+    assert horizon > version
+
+    # syncing again from 0 gives the catalog, and a version past the purge
+    mirror = {}
+    assert sync(client, mirror) >= horizon
+    assert mirror == catalogMirror(client)
+    assert client.get("/catalog/changes?since={0}".format(
+        horizon)).status_code == 200
+
+
+@pytest.mark.parametrize("query", ["since=x", "since=-1", "after=!!",
+                                   "after=WzFd"])
+def test_bad_since_or_cursor_is_a_400(client, query):
+    assert client.get("/catalog/changes?" + query).status_code == 400
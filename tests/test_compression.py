@@ -0,0 +1,41 @@
+"""
+Tests of the WSGI compression middleware against bare WSGI apps.
+"""
+import gzip
+
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from compression import CompressionMiddleware
+
+BODY = b"catalog " * 512
+
+
+def returningApp(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/html")])
+    return [BODY]
+
+
+def writingApp(environ, start_response):
+    write = start_response("200 OK", [("Content-Type", "text/html")])
+    write(BODY[:1000])
+    write(BODY[1000:])
+    return []
+
+
+def get(app):
+    return Client(CompressionMiddleware(app), Response).get(
+        "/", headers={"Accept-Encoding": "gzip"})
+
+
+def test_returned_body_is_compressed():
+    response = get(returningApp)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.get_data()) == BODY
+
+
+def test_written_body_is_passed_through():
+    response = get(writingApp)
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+    assert response.get_data() == BODY
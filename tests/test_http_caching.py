@@ -0,0 +1,58 @@
+"""
+Tests of the conditional GET handling, in particular that a client sending
+only If-Modified-Since never gets a stale 304.
+"""
+from datetime import datetime, timedelta
+
+from werkzeug.http import http_date
+
+from httpCaching import settledLastModified
+from models import CatalogState
+
+import catalogApp
+import httpCaching
+
+
+def setUpdated(updated):
+    catalogApp.session.query(CatalogState).filter_by(id=1).update(
+        {"version": CatalogState.version + 1, "updated_at": updated})
+    catalogApp.session.commit()
+    catalogApp.session.remove()
+
+
+def test_last_modified_is_settled_once_its_second_is_over():
+    now = datetime(2024, 5, 1, 12, 0, 1, 200000)
+    assert settledLastModified(now - timedelta(seconds=1), now) is not None
+    assert settledLastModified(datetime(2024, 5, 1, 12, 0, 1), now) is None
+    assert settledLastModified(None, now) is None
+
+
+def test_if_modified_since_answered_for_a_settled_change(app, seed):
+    seed(2, 2)
+    client = app.test_client()
+    updated = datetime.utcnow().replace(microsecond=0) - timedelta(minutes=1)
+    setUpdated(updated)
+    response = client.get("/catalog/JSON")
+    assert response.headers["Last-Modified"] == http_date(updated)
+    response = client.get("/catalog/JSON", headers={
+        "If-Modified-Since": response.headers["Last-Modified"]})
+    assert response.status_code == 304
+
+
+def test_if_modified_since_ignored_within_the_changed_second(app, seed,
+                                                             monkeypatch):
+    seed(2, 2)
+    client = app.test_client()
+    updated = datetime(2024, 5, 1, 12, 0, 0, 300000)
+    setUpdated(updated)
+
+    class Now(datetime):
+        @classmethod
+        def utcnow(cls):
+            return updated + timedelta(microseconds=400000)
+    monkeypatch.setattr(httpCaching, "datetime", Now)
+    # the client fetched earlier in the same second as the change
+    response = client.get("/catalog/JSON", headers={
+        "If-Modified-Since": http_date(updated)})
+    assert response.status_code == 200
+    assert "Last-Modified" not in response.headers
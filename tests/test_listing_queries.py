@@ -0,0 +1,47 @@
+"""
+Regression tests for the number of SQL statements the HTML listing pages
+issue, so that an N+1 query reintroduced in a view or template fails the
+build rather than only showing in 'python3 benchmark.py pages'.
+"""
+import pytest
+
+from benchmark import PAGE_QUERY_BUDGET, QueryCounter
+
+import catalogApp
+
+# Enough items per category that a statement per item can't hide under the
+# budgets
+CATEGORIES = 5
+ITEMS = 40
+
+# The number of SQL statements each listing page is allowed to issue with
+# the caches empty, see benchmark.PAGE_QUERY_BUDGET for warm caches
+COLD_QUERY_BUDGET = {
+    "/catalog/": 3,
+    "/catalog/category/1/": 4,
+}
+
+
+@pytest.fixture(scope="module")
+def client(app, seed):
+    seed(CATEGORIES, ITEMS)
+    return app.test_client()
+
+
+def countQueries(client, url):
+    with QueryCounter(catalogApp.engine) as counter:
+        response = client.get(url)
+    assert response.status_code == 200
+    return counter.count
+
+
+@pytest.mark.parametrize("url", sorted(PAGE_QUERY_BUDGET))
+def test_warm_page_within_budget(client, url):
+    client.get(url)
+    assert countQueries(client, url) <= PAGE_QUERY_BUDGET[url]
+
+
+@pytest.mark.parametrize("url", sorted(COLD_QUERY_BUDGET))
+def test_cold_page_within_budget(client, url):
+    catalogApp.invalidateCaches()
+    assert countQueries(client, url) <= COLD_QUERY_BUDGET[url]
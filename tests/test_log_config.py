@@ -0,0 +1,26 @@
+"""
+Tests of the logging setup.
+"""
+import logging
+import os
+
+from logConfig import configureLogging, stopLogging
+
+
+def test_missing_log_directory_is_created(tmp_path):
+    logDir = str(tmp_path / "fresh" / "logs")
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    listener = configureLogging(logDir)
+    try:
+        logging.getLogger("catalog.test").warning("written")
+    finally:
+        stopLogging(listener)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in handlers:
+            root.addHandler(handler)
+        for handler in listener.handlers:
+            handler.close()
+    with open(os.path.join(logDir, "debug.log")) as log:
+        assert "written" in log.read()
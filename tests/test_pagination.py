@@ -0,0 +1,49 @@
+"""
+Tests of the paging cursors, which come straight from the query string and
+must be rejected with a ValueError (a 400) rather than reach the DB when
+they don't hold a sort key.
+"""
+import pytest
+
+from pagination import decodeCursor, encodeCursor
+
+
+def test_cursor_round_trips():
+    values = ["category000001", 2]
+    assert decodeCursor(encodeCursor(values), 2, [str, int]) == values
+
+
+@pytest.mark.parametrize("values", [
+    ["x", {"a": 1}],
+    [[1], 2],
+    [True, 1],
+])
+def test_cursor_rejects_non_scalar_values(values):
+    with pytest.raises(ValueError):
+        decodeCursor(encodeCursor(values), 2)
+
+
+@pytest.mark.parametrize("values", [
+    [1, "x"],
+    ["x", 2.5],
+    ["x", False],
+])
+def test_cursor_rejects_values_of_the_wrong_type(values):
+    with pytest.raises(ValueError):
+        decodeCursor(encodeCursor(values), 2, [str, int])
+
+
+@pytest.mark.parametrize("cursor", ["!!!", encodeCursor(["x"]),
+                                    encodeCursor({"a": 1})])
+def test_cursor_rejects_malformed_cursors(cursor):
+    with pytest.raises(ValueError):
+        decodeCursor(cursor, 2)
+
+
+def test_listing_answers_a_bad_cursor_with_400(app, seed):
+    seed(3, 2)
+    client = app.test_client()
+    for url in ("/catalog/", "/catalog/category/JSON"):
+        response = client.get("{0}?after={1}".format(
+            url, encodeCursor(["x", {"a": 1}])))
+        assert response.status_code == 400